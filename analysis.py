@@ -0,0 +1,111 @@
+import os
+import argparse
+import pandas as pd
+from conference import iter_conference
+from storage import load_dict
+from identity import get_identity_index
+
+# tabela colunar das publicações: uma linha por publicação, só com os campos usados
+# nas análises, ano como inteiro e venue/idioma como categorias; as citações recebidas
+# vêm contadas no total e por filiação do citante
+CITER_CATEGORIES = {True: 'citations_lusophone', False: 'citations_non_lusophone', None: 'citations_unknown'}
+CITATION_COLUMNS = ['citations'] + list(CITER_CATEGORIES.values())
+PUBLICATION_COLUMNS = ['venue', 'doi', 'year', 'language'] + CITATION_COLUMNS
+
+def load_publication_table(conference_alias, citations=None, doi_dict=None, include_title=False, identities=None):
+    if identities is None:
+        identities = get_identity_index()
+    if citations is None:
+        citations = load_dict(os.path.join('data', 'citations.json'))
+    if doi_dict is None:
+        doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
+
+    dois = []
+    years = []
+    languages = []
+    citation_counts = {column: [] for column in CITATION_COLUMNS}
+    titles = []
+    for publication in iter_conference(conference_alias):
+        info = publication['info']
+        doi = info.get('doi')
+        dois.append(doi.lower() if doi is not None else None)
+        years.append(int(info['year']))
+        languages.append(publication.get('language'))
+        if include_title:
+            titles.append(info['title'])
+
+        counts = dict.fromkeys(CITATION_COLUMNS, 0)
+        for citing_doi in identities.canonicalize(citations.get(doi, [])) if doi is not None else []:
+            verdict = doi_dict[citing_doi].get('authors_related_to_portuguese') if citing_doi in doi_dict else None
+            counts['citations'] += 1
+            counts[CITER_CATEGORIES[verdict]] += 1
+        for column, count in counts.items():
+            citation_counts[column].append(count)
+
+    table = pd.DataFrame({
+        'venue': pd.Categorical([conference_alias] * len(dois)),
+        'doi': pd.array(dois, dtype='string'),
+        'year': pd.array(years, dtype='int16'),
+        'language': pd.Categorical(languages),
+        **{column: pd.array(counts, dtype='int32') for column, counts in citation_counts.items()},
+    })
+    if include_title:
+        table['title'] = pd.array(titles, dtype='string')
+    return table
+
+def concat_publication_tables(tables):
+    # o concat de categorias diferentes vira object, as colunas voltam a ser categorias
+    table = pd.concat(tables, ignore_index=True)
+    for column in ('venue', 'language'):
+        table[column] = table[column].astype('category')
+    return table
+
+def aggregate_publication_table(table, group_columns):
+    # publicações e citações somadas por grupo; publicações sem idioma ficam num grupo próprio
+    aggregated = (table.groupby(group_columns, observed=True, dropna=False)
+                  .agg(publications=('citations', 'size'), **{column: (column, 'sum') for column in CITATION_COLUMNS})
+                  .reset_index())
+    aggregated['citations_mean'] = aggregated['citations'] / aggregated['publications']
+    return aggregated
+
+# motor de análise: a tabela de cada conferência filtrada pelos anos e agregada
+# por venue × ano × idioma, com as citações separadas pela filiação do citante
+ANALYSIS_COLUMNS = ['publications'] + CITATION_COLUMNS
+
+def parse_years(years_str):
+    years = set()
+    for part in years_str.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            years.update(range(int(first), int(last) + 1))
+        else:
+            years.add(int(part))
+    return years
+
+def analyze_conferences(conference_aliases, years=None, citations=None, doi_dict=None, identities=None):
+    if identities is None:
+        identities = get_identity_index()
+    if citations is None:
+        citations = load_dict(os.path.join('data', 'citations.json'))
+    if doi_dict is None:
+        doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
+
+    table = concat_publication_tables([load_publication_table(conference_alias, citations, doi_dict, identities=identities)
+                                       for conference_alias in conference_aliases])
+    if years is not None:
+        table = table[table['year'].isin(years)]
+    aggregated = aggregate_publication_table(table, ['venue', 'year', 'language'])
+    return aggregated.sort_values(['venue', 'year', 'language'], ignore_index=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publicações e citações por venue, ano, idioma e filiação dos citantes')
+    parser.add_argument('conferences', nargs='+', help='aliases dblp, ex.: sbsi sbsi_new')
+    parser.add_argument('--years', help='anos, ex.: 2010-2022 ou 2015,2017')
+    parser.add_argument('--output', help='arquivo csv de saída')
+    args = parser.parse_args()
+
+    table = analyze_conferences(args.conferences, parse_years(args.years) if args.years else None)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    else:
+        print(table.to_string(index=False))
@@ -0,0 +1,149 @@
+import asyncio
+import signal
+import traceback
+from http_service import http_get, is_negative_cached, get_cached_failure, record_failure, clear_failure, PERMANENT_FAILURE_KINDS
+from identity import get_identity_index, is_doi
+
+# quem cita e quem é citado, pelo opencitations e pelo semantic scholar, e o que os crawls
+# assíncronos usam para chamar esses fetchers bloqueantes com limite por serviço
+def get_citing_dois_oc(doi):
+    if is_negative_cached('oc_citations', doi):
+        return list()
+
+    try:
+        response = http_get(f'https://opencitations.net/index/api/v1/citations/{doi}', headers={ 'Accept': 'application/json' })
+        response.raise_for_status()
+        citations = [citation['citing'] for citation in response.json()]
+    except Exception as err:
+        print('Erro ocorrido3: {0}'.format(err))
+        traceback.print_exc()
+        record_failure('oc_citations', doi, err)
+        return list()
+    clear_failure('oc_citations', doi)
+
+    if len(citations) == 0:
+        return list()
+
+    citing_dois = set()
+    for citation in citations:
+        citing_dois.update([x.split('=>')[1].strip().lower() for x in citation.split(';')])
+
+    return list(citing_dois)
+
+def get_cited_dois_oc(doi):
+    if is_negative_cached('oc_references', doi):
+        return list()
+
+    try:
+        response = http_get(f'https://opencitations.net/index/api/v1/references/{doi}', headers={ 'Accept': 'application/json' })
+        response.raise_for_status()
+        references = [reference['cited'] for reference in response.json()]
+    except Exception as err:
+        print('Erro ocorrido3: {0}'.format(err))
+        record_failure('oc_references', doi, err)
+        return list()
+    clear_failure('oc_references', doi)
+
+    cited_dois = set()
+    for reference in references:
+        cited_dois.update([x.split('=>')[1].strip().lower() for x in reference.split(';')])
+    return list(cited_dois)
+
+def read_paper_ss(paper_id):
+    # aceita doi ou paperId; a mesma resposta traz citações e referências
+    if is_negative_cached('ss_citations', paper_id):
+        return None
+
+    try:
+        response = http_get(f'https://api.semanticscholar.org/v1/paper/{paper_id}', headers={ 'Accept': 'application/json' })
+        response.raise_for_status()
+        response_json = response.json()
+        response_json['citations']
+    except Exception as err:
+
+        # print('Erro ocorrido4: {0}'.format(err))
+        # traceback.print_exc()
+        record_failure('ss_citations', paper_id, err)
+        return None
+    clear_failure('ss_citations', paper_id)
+
+    identities = get_identity_index()
+    identities.link_paper_ss(response_json)
+    for citation in response_json['citations'] + (response_json.get('references') or []):
+        identities.link_paper_ss(citation)
+    return response_json
+
+def get_citing_dois_and_pids_ss(doi):
+    paper = read_paper_ss(doi)
+    if paper is None:
+        return list(), list()
+
+    citations = paper['citations']
+
+    if len(citations) == 0:
+        return list(), list()
+
+    citing_dois = set()
+    citing_pids = set()
+    identities = get_identity_index()
+    for citation in citations:
+
+        if citation['doi'] == 'null' or citation['doi'] == None:
+            # o doi pode ter vindo de outra resposta, aí o citante é o doi
+            canonical = identities.get_canonical(citation['paperId'])
+            if is_doi(canonical):
+                citing_dois.update([canonical])
+            else:
+                citing_pids.update([canonical])
+            continue
+        
+        if citation['doi'][:7] == '10.5555':
+            print(f'burro:{citation["doi"]}')
+            continue
+
+        citing_dois.update([citation['doi'].lower()])
+
+    return list(citing_dois), list(citing_pids)
+
+# as duas fontes de citantes de uma publicação
+CITATION_LOOKUPS = ('oc_citations', 'ss_citations')
+
+def is_citation_list_complete(doi, lookups=CITATION_LOOKUPS):
+    # cada fonte respondeu ou não tem o artigo; com uma falha transitória a lista é parcial
+    return all(get_cached_failure(lookup, doi) in (None, *PERMANENT_FAILURE_KINDS) for lookup in lookups)
+
+# máximo de requisições simultâneas por serviço durante o crawl
+CRAWL_CONCURRENCY = {
+    'opencitations': 4,
+    'semanticscholar': 2,
+    'crossref': 8,
+    'datacite': 4,
+}
+
+async def run_limited(semaphores, service, func, *args):
+    async with semaphores[service]:
+        return await asyncio.to_thread(func, *args)
+
+def install_stop_handler(stop):
+    # ctrl-c não mata o crawl: nada novo começa, o que está em andamento termina e o checkpoint é gravado.
+    # o primeiro ctrl-c devolve o handler padrão, um segundo interrompe de vez; devolve a função que o restaura
+    loop = asyncio.get_running_loop()
+    handlers = { 'loop': True }
+
+    def restore():
+        if handlers['loop']:
+            loop.remove_signal_handler(signal.SIGINT)
+        else:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    def request_stop(*args):
+        print('interrompendo: terminando as requisições em andamento e gravando o checkpoint (ctrl-c de novo para abortar)')
+        loop.call_soon_threadsafe(stop.set)
+        loop.call_soon_threadsafe(restore)
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, request_stop)
+    except NotImplementedError:
+        handlers['loop'] = False
+        signal.signal(signal.SIGINT, request_stop)
+    return restore
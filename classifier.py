@@ -0,0 +1,292 @@
+import re
+import os
+import sys
+import math
+import functools
+import multiprocessing
+from storage import load_dict, save_dict
+
+REMOVE_ACCENTS_TRANSLATION = str.maketrans('áéíóúàèìòùãõâêîôû', 'aeiouaeiouaoaeiou')
+PORTUGUESE_COUNTRIES_CASEFOLDED = ('mozambique', 'mocambique', 'moçambique', 'brazil', 'brasil', 'angola', 'cabo verde', 'cape verde', 
+                                   'macau', 'timor leste', 'east timor', 'equatorial guinea', 'guine-bissau', 'guinea-bissau', 'portugal')
+COUNTRIES_CASEFOLDED = ('afghanistan', 'aland islands', 'albania', 'algeria', 'american samoa', 'andorra', 'angola', 'anguilla', 
+                        'antarctica', 'antigua and barbuda', 'argentina', 'armenia', 'aruba', 'australia', 'austria', 'azerbaijan', 
+                        'bahamas', 'bahrain', 'bangladesh', 'barbados', 'belarus', 'belgium', 'belize', 'benin', 'bermuda', 'bhutan', 
+                        'bolivia', 'bonaire', 'bosnia and herzegovina', 'bosnia', 'herzegovina', 'botswana', 
+                        'bouvet', 'british indian ocean territory', 'brunei', 'bulgaria', 'burkina faso', 
+                        'burundi', 'cambodia', 'cameroon', 'canada', 'cayman islands', 'central african republic', 'chad', 
+                        'chile', 'china', 'christmas island', 'cocos (keeling) islands', 'keeling', 'colombia', 'comoros', 'congo', 'cook islands', 
+                        'costa rica', "côte d'ivoire", 'croatia', 'cuba', 'curaçao', 'curacao', 'cyprus', 'czechia', 'denmark', 'djibouti', 
+                        'dominica', 'dominican republic', 'ecuador', 'egypt', 'el salvador', 'equatorial guinea', 'eritrea', 'estonia', 
+                        'ethiopia', 'falkland islands', 'malvinas', 'faroe islands', 'fiji', 'finland', 'france', 'french guiana', 
+                        'french polynesia', 'french southern territories', 'gabon', 'gambia', 'georgia', 'germany', 'ghana', 'gibraltar', 
+                        'greece', 'greenland', 'grenada', 'guadeloupe', 'guam', 'guatemala', 'guernsey', 'guinea', 'guinea-bissau', 
+                        'guyana', 'haiti', 'heard island and mcdonald islands', 'holy see', 'honduras', 'hong kong', 'hungary', 'iceland', 
+                        'india', 'indonesia', 'iran, islamic republic of', 'iraq', 'ireland', 'isle of man', 'israel', 'italy', 'jamaica', 
+                        'japan', 'jersey', 'jordan', 'kazakhstan', 'kenya', 'kiribati', "korea, democratic people's republic of", 
+                        'korea, republic of', 'kosovo', 'kuwait', 'kyrgyzstan', "lao people's democratic republic", 'laos', 'latvia', 'lebanon', 
+                        'lesotho', 'liberia', 'libya', 'liechtenstein', 'lithuania', 'luxembourg', 'macao', 'north macedonia', 'madagascar', 
+                        'malawi', 'malaysia', 'maldives', 'mali', 'malta', 'marshall islands', 'martinique', 'mauritania', 'mauritius', 
+                        'mayotte', 'mexico', 'micronesia, federated states of', 'moldova, republic of', 'monaco', 'mongolia', 'montenegro', 
+                        'montserrat', 'morocco', 'mozambique', 'myanmar', 'namibia', 'nauru', 'nepal', 'netherlands', 'new caledonia', 'new zealand', 
+                        'nicaragua', 'niger', 'nigeria', 'niue', 'norfolk island', 'northern mariana islands', 'norway', 'oman', 'pakistan', 
+                        'palau', 'palestine, state of', 'panama', 'papua new guinea', 'paraguay', 'peru', 'philippines', 'pitcairn', 
+                        'poland', 'puerto rico', 'qatar', 'reunion', 'romania', 'russian federation', 'rwanda', 'saint barthélemy', 
+                        'saint helena, ascension and tristan da cunha', 'saint kitts and nevis', 'saint lucia', 'saint martin (french part)', 
+                        'saint pierre and miquelon', 'saint vincent and the grenadines', 'samoa', 'san marino', 'sao tome and principe', 
+                        'saudi arabia', 'senegal', 'serbia', 'seychelles', 'sierra leone', 'singapore', 'sint maarten (dutch part)', 
+                        'slovakia', 'slovenia', 'solomon islands', 'somalia', 'south africa', 'south georgia and the south sandwich islands', 
+                        'south sudan', 'spain', 'sri lanka', 'sudan', 'suriname', 'svalbard and jan mayen', 'eswatini', 'sweden', 
+                        'switzerland', 'syrian arab republic', 'taiwan, province of china', 'tajikistan', 'tanzania, united republic of', 
+                        'thailand', 'timor-leste', 'togo', 'tokelau', 'tonga', 'trinidad and tobago', 'tunisia', 'türkiye', 'turkmenistan', 
+                        'turks and caicos islands', 'tuvalu', 'uganda', 'ukraine', 'united arab emirates', 'united kingdom of great britain and northern ireland', 
+                        'great britain', 'northern ireland', 'ireland',
+                        'united states of america', 'united states minor outlying islands', 'uruguay', 'uzbekistan', 'vanuatu', 
+                        'venezuela, bolivarian republic of', 'viet nam', 'virgin islands, british', 'virgin islands, u.s.', 'wallis and futuna', 
+                        'western sahara', 'yemen', 'zambia', 'zimbabwe', 'united states', 'iran', 'united kingdom', 'turkey', 'itally', 'russia')
+BRAZILIAN_STATES_CASEFOLDED = tuple(x.casefold() for x in ['Acre',
+'alagoas',
+'amapa',
+'amazonas',
+'bahia',
+'Ceara',
+'Distrito Federal',
+'Espirito Santo',
+'Goias',
+'Maranhao',
+'Mato Grosso',
+'Mato Grosso do Sul',
+'Minas Gerais',
+'Para',
+'Paraiba',
+'Parana',
+'Pernambuco',
+'Piaui',
+'Rio de Janeiro',
+'Rio Grande do Norte',
+'Rio Grande do Sul',
+'Rondonia',
+'Roraima',
+'Santa Catarina',
+'Sao Paulo',
+'Sergipe',
+'Tocantins'])
+
+def build_term_regex(terms):
+    # as alternativas viram uma trie, cada posição do texto é testada em tempo proporcional à profundidade
+    trie = dict()
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, dict())
+        node[''] = True
+
+    def build_pattern(node):
+        alternatives = [re.escape(char) + build_pattern(child) for char, child in sorted(node.items()) if char != '']
+        if len(alternatives) == 0:
+            return ''
+        if len(alternatives) == 1 and '' not in node:
+            return alternatives[0]
+        pattern = '(?:' + '|'.join(alternatives) + ')'
+        return pattern + '?' if '' in node else pattern
+
+    return re.compile(build_pattern(trie))
+
+LUSOPHONE_AFFILIATION_REGEX = build_term_regex(BRAZILIAN_STATES_CASEFOLDED + PORTUGUESE_COUNTRIES_CASEFOLDED)
+LUSOPHONE_BIOGRAPHY_REGEX = build_term_regex(BRAZILIAN_STATES_CASEFOLDED + ('brasil', 'brazil'))
+COUNTRIES_CASEFOLDED_SET = frozenset(COUNTRIES_CASEFOLDED)
+COUNTRIES_CASEFOLDED_LENGTHS = tuple(sorted(set(map(len, COUNTRIES_CASEFOLDED))))
+
+def find_country_suffix(text):
+    for length in COUNTRIES_CASEFOLDED_LENGTHS:
+        if text[-length:] in COUNTRIES_CASEFOLDED_SET:
+            return text[-length:]
+    return None
+
+def match_lusophone_location(text, lusophone_regex=LUSOPHONE_AFFILIATION_REGEX):
+    # retorna (veredito, regra, trechos encontrados); veredito None quando nenhuma regra decide
+    hits = [match.group(0) for match in lusophone_regex.finditer(text)]
+    if len(hits) > 0:
+        return True, 'lusophone_location', hits
+    country = find_country_suffix(text)
+    if country is not None:
+        return False, 'country_suffix', [country]
+    return None, None, []
+
+def clean_affiliation(affiliation):
+    return affiliation.casefold().translate(REMOVE_ACCENTS_TRANSLATION).strip('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+
+# camada pura de classificação: recebe os metadados já baixados e as tabelas de
+# veredito (affiliations.json, orcid.json) e não faz rede nem altera os dicts
+
+LUSOPHONE_COUNTRY_CODES = ('AO', 'BR', 'CV', 'GW', 'MZ', 'PT', 'ST')
+ORCID_REGEX = re.compile(r'\d{4}-\d{4}-\d{4}-\d{3}[\dX]')
+CLASSIFIER_CACHE_SIZE = 2 ** 16
+
+@functools.lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def classify_affiliation_text(affiliation_clean):
+    return match_lusophone_location(affiliation_clean)[0]
+
+@functools.lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def classify_biography_text(biography_clean):
+    return match_lusophone_location(biography_clean, LUSOPHONE_BIOGRAPHY_REGEX)[0]
+
+def get_dict(parent, key):
+    value = parent.get(key, dict())
+    return value if type(value) is dict else dict()
+
+def get_list(parent, key):
+    value = parent.get(key, [])
+    return value if type(value) is list else list()
+
+def get_orcid_biography(orcid_entry):
+    content_str = get_dict(get_dict(orcid_entry, 'person'), 'biography').get('content', None)
+    if type(content_str) is not str:
+        return None
+    return clean_affiliation(content_str)
+
+def classify_orcid_record(orcid_entry):
+    if 'person' not in orcid_entry:
+        return None
+    person_dict = get_dict(orcid_entry, 'person')
+
+    addresses_list = get_list(get_dict(person_dict, 'addresses'), 'address')
+    if len(addresses_list) > 0:
+        return any(get_dict(address, 'country').get('value', None) in LUSOPHONE_COUNTRY_CODES for address in addresses_list)
+
+    employments_list = get_list(get_dict(orcid_entry, 'employments'), 'employment-summary')
+    if len(employments_list) > 0:
+        return any(get_dict(get_dict(employment, 'organization'), 'address').get('value', None) in LUSOPHONE_COUNTRY_CODES for employment in employments_list)
+
+    biography = get_orcid_biography(orcid_entry)
+    if biography is None:
+        return None
+    return classify_biography_text(biography)
+
+def get_affiliation_verdict(affiliation_raw, affiliation_dict):
+    affiliation_clean = clean_affiliation(affiliation_raw)
+    if affiliation_clean in affiliation_dict:
+        return affiliation_dict[affiliation_clean]
+    return classify_affiliation_text(affiliation_clean)
+
+def get_orcid_verdict(orcid, orcid_dict):
+    orcid_entry = orcid_dict.get(orcid)
+    if orcid_entry is None:
+        return None
+    if 'related_to_portuguese' in orcid_entry:
+        return orcid_entry['related_to_portuguese']
+    return classify_orcid_record(orcid_entry)
+
+def combine_author_verdict(affiliation_verdicts, orcid_verdict):
+    # como no fluxo original, afiliação não lusófona sozinha não decide o autor
+    verdict = True if any(affiliation_verdicts) else None
+    if orcid_verdict is not None:
+        verdict = bool(verdict) or orcid_verdict
+    return verdict
+
+def get_orcid_id_from_url(orcid_url):
+    if orcid_url[-4] == '-':
+        return orcid_url[-18:] + 'X'
+    return orcid_url[-19:]
+
+def classify_author_crossref(author, affiliation_dict, orcid_dict):
+    affiliation_verdicts = [get_affiliation_verdict(affiliation_raw['name'], affiliation_dict) for affiliation_raw in author.get('affiliation', [])]
+    orcid_verdict = get_orcid_verdict(author['ORCID'][-19:], orcid_dict) if 'ORCID' in author else None
+    return combine_author_verdict(affiliation_verdicts, orcid_verdict)
+
+def classify_author_datacite(creator, affiliation_dict, orcid_dict):
+    affiliation_verdicts = [get_affiliation_verdict(affiliation_raw, affiliation_dict) for affiliation_raw in creator.get('affiliation', [])]
+    verdict = combine_author_verdict(affiliation_verdicts, None)
+    for name_identifier_dict in creator.get('nameIdentifiers', []):
+        if name_identifier_dict['scheme'] == 'ORCID':
+            orcid_verdict = get_orcid_verdict(get_orcid_id_from_url(name_identifier_dict['nameIdentifier']), orcid_dict)
+            if orcid_verdict is not None:
+                verdict = bool(verdict) or orcid_verdict
+    return verdict
+
+def classify_authors(doi_entry, affiliation_dict, orcid_dict):
+    if 'metadata' not in doi_entry and 'metadata_oc' in doi_entry:
+        verdicts = []
+        for author_raw in (doi_entry['metadata_oc'].get('author') or '').split(';'):
+            orcid_ids = ORCID_REGEX.findall(author_raw)
+            if len(orcid_ids) > 0:
+                verdicts.append(get_orcid_verdict(orcid_ids[0], orcid_dict))
+            elif author_raw.strip() != '':
+                verdicts.append(None)
+        return verdicts
+
+    metadata = doi_entry.get('metadata', dict())
+    if doi_entry.get('agency') == 'crossref':
+        return [classify_author_crossref(author, affiliation_dict, orcid_dict) for author in get_dict(metadata, 'message').get('author', [])]
+    if doi_entry.get('agency') == 'datacite':
+        return [classify_author_datacite(creator, affiliation_dict, orcid_dict) for creator in get_dict(metadata, 'data').get('creators', [])]
+    return []
+
+def classify_doi(doi, doi_entry, affiliation_dict, orcid_dict):
+    # True/False quando decidido, None quando ainda há autores desconhecidos
+    if doi[:8] == '10.5753/':
+        return True
+    verdicts = classify_authors(doi_entry, affiliation_dict, orcid_dict)
+    if any(verdict is True for verdict in verdicts):
+        return True
+    if len(verdicts) > 0 and all(verdict is False for verdict in verdicts):
+        return False
+    return None
+
+def classify_doi_dict(doi_dict, affiliation_dict, orcid_dict, dois=None):
+    if dois is None:
+        dois = list(doi_dict.keys())
+    return {doi: classify_doi(doi, doi_dict[doi], affiliation_dict, orcid_dict) for doi in dois if doi in doi_dict}
+
+# classificação do corpus inteiro em processos; as tabelas ficam em globais antes
+# do fork e os workers as leem por copy-on-write, só as chaves e os vereditos trafegam
+shared_tables = None
+
+def classify_shard(dois):
+    doi_dict, affiliation_dict, orcid_dict = shared_tables
+    return classify_doi_dict(doi_dict, affiliation_dict, orcid_dict, dois)
+
+def classify_doi_dict_parallel(doi_dict, affiliation_dict, orcid_dict, processes=None, shard_size=None):
+    global shared_tables
+    processes = processes or os.cpu_count() or 1
+    dois = list(doi_dict.keys())
+    if shard_size is None:
+        shard_size = max(1, math.ceil(len(dois) / (processes * 4)))
+    shards = [dois[i:i + shard_size] for i in range(0, len(dois), shard_size)]
+
+    shared_tables = (doi_dict, affiliation_dict, orcid_dict)
+    verdicts = dict()
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            for shard_verdicts in pool.imap_unordered(classify_shard, shards):
+                verdicts.update(shard_verdicts)
+    finally:
+        shared_tables = None
+    return verdicts
+
+def classify_all(processes=None):
+    doi_json_path = os.path.join('data', 'doi_metadata.json')
+    doi_dict = load_dict(doi_json_path)
+    # as tabelas viram dicts simples, a conexão do sqlite não pode atravessar o fork
+    affiliation_dict = dict(load_dict(os.path.join('data', 'affiliations.json')).items())
+    orcid_dict = dict(load_dict(os.path.join('data', 'orcid.json')).items())
+
+    verdicts = classify_doi_dict_parallel(dict(doi_dict.items()), affiliation_dict, orcid_dict, processes)
+    for doi, verdict in verdicts.items():
+        if verdict is None:
+            doi_dict[doi].pop('authors_related_to_portuguese', None)
+        else:
+            doi_dict[doi]['authors_related_to_portuguese'] = verdict
+    save_dict(doi_dict, doi_json_path)
+    return verdicts
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'classify-all':
+        verdicts = classify_all(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        print(f'{len(verdicts)} dois classificados: '
+              f'{sum(verdict is True for verdict in verdicts.values())} lusófonos, '
+              f'{sum(verdict is False for verdict in verdicts.values())} não lusófonos, '
+              f'{sum(verdict is None for verdict in verdicts.values())} desconhecidos')
+    else:
+        print('uso: python classifier.py classify-all [processos]')
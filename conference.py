@@ -0,0 +1,119 @@
+import os
+import json
+import math
+import threading
+import multiprocessing
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from storage import write_atomic, iter_json_array, iter_jsonl, write_jsonl
+
+# publicações das conferências do dblp: download, cache local (.json ou .jsonl) e idioma dos títulos;
+# fica fora do main para que análises e crawls importem só isto
+FASTTEXT_MODEL_PATH = 'lid.176.ftz'
+fasttext_model = None
+fasttext_model_lock = threading.Lock()
+
+def get_fasttext_model():
+    # carrega o modelo só no primeiro uso, todos os chamadores compartilham a mesma instância
+    global fasttext_model
+    if fasttext_model is None:
+        with fasttext_model_lock:
+            if fasttext_model is None:
+                import fasttext
+                fasttext_model = fasttext.load_model(FASTTEXT_MODEL_PATH)
+    return fasttext_model
+
+def get_fasttext_worker_pool(processes=None):
+    # o modelo é carregado no processo pai antes do fork, assim os workers
+    # compartilham as mesmas páginas (copy-on-write) em vez de N cópias
+    get_fasttext_model()
+    return multiprocessing.get_context('fork').Pool(processes)
+
+def download_conference_page(conference_alias, page_size, offset):
+    from http_service import http_get
+    response = http_get('https://dblp.org/search/publ/api?q=stream:conf/{0}:&format=json&h={1}&f={2}'.format(conference_alias, page_size, offset))
+    response.raise_for_status()
+    return response.json()['result']['hits'].get('hit', [])
+
+def download_conference(conference_alias, page_size=100, max_workers=4):
+    # a sessão http só é criada quando há download, ler uma conferência salva não precisa dela
+    from http_service import http_get
+    try:
+        response = http_get('https://dblp.org/search/publ/api?q=stream:conf/{0}:&format=json&h=0'.format(conference_alias))
+        response.raise_for_status()
+        publications_count = int(response.json()['result']['hits']['@total'])
+        offsets = [f*page_size for f in range(int(math.ceil(publications_count/page_size)))]
+
+        # lista pré-alocada, cada página é escrita na sua posição para manter a ordem do dblp
+        publications = [None] * publications_count
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(download_conference_page, conference_alias, page_size, offset): offset for offset in offsets}
+            for future in as_completed(futures):
+                offset = futures[future]
+                hits = future.result()[:max(0, publications_count - offset)]
+                publications[offset:offset + len(hits)] = hits
+
+    except Exception as err:
+        print('Erro ocorrido1: {0}'.format(err))
+        traceback.print_exc()
+        return None
+
+    if None in publications:
+        publications[:] = [publication for publication in publications if publication is not None]
+    classify_publications_language(publications)
+    return publications
+
+def save_conference_locally(conference_alias, conference=None):
+    if conference is None:
+        conference = download_conference(conference_alias)
+    conference_json = json.dumps(conference, indent=4)
+    write_atomic(conference_json, 'conferences/{0}.json'.format(conference_alias))
+    # o .jsonl tem prioridade na leitura, então é regravado junto para não ficar velho
+    if os.path.isfile('conferences/{0}.jsonl'.format(conference_alias)):
+        write_jsonl(conference, 'conferences/{0}.jsonl'.format(conference_alias))
+
+def load_conference(conference_alias, force=False):
+    if not force and os.path.isfile('conferences/{0}.jsonl'.format(conference_alias)):
+        return list(iter_jsonl('conferences/{0}.jsonl'.format(conference_alias)))
+    if force or not os.path.isfile('conferences/{0}.json'.format(conference_alias)):
+        save_conference_locally(conference_alias)
+    with open('conferences/{0}.json'.format(conference_alias), 'r') as input_file:
+        return json.load(input_file)
+
+def iter_conference(conference_alias, force=False):
+    # devolve as publicações uma a uma, sem carregar o arquivo inteiro
+    if not force and os.path.isfile('conferences/{0}.jsonl'.format(conference_alias)):
+        return iter_jsonl('conferences/{0}.jsonl'.format(conference_alias))
+    if force or not os.path.isfile('conferences/{0}.json'.format(conference_alias)):
+        save_conference_locally(conference_alias)
+    return iter_json_array('conferences/{0}.json'.format(conference_alias))
+
+def migrate_conference_to_jsonl(conference_alias):
+    write_jsonl(iter_json_array('conferences/{0}.json'.format(conference_alias)), 'conferences/{0}.jsonl'.format(conference_alias))
+
+def classify_publication_language_fasttext(publication):
+    language = get_fasttext_model().predict(clean_title(publication['info']['title']), k=1)[0][0]
+    publication['language'] = language
+    return publication
+
+def classify_publication_language(publication):
+    return classify_publication_language_fasttext(publication)
+
+def clean_title(title):
+    return title.split('[')[0].replace('\n', ' ')
+
+def classify_publications_language_fasttext(publications):
+    titles = [clean_title(publication['info']['title']) for publication in publications]
+    if len(titles) == 0:
+        return publications
+    labels, probabilities = get_fasttext_model().predict(titles, k=1)
+    for publication, label, probability in zip(publications, labels, probabilities):
+        publication['language'] = label[0]
+        publication['language_probability'] = float(probability[0])
+    return publications
+
+def classify_publications_language(publications):
+    return classify_publications_language_fasttext(publications)
+
+def get_doi(publication):
+    return publication.get('info', {}).get('doi', None)
@@ -0,0 +1,305 @@
+import os
+import heapq
+import asyncio
+import argparse
+from conference import iter_conference, get_doi
+from citation_service import (get_citing_dois_oc, get_cited_dois_oc, read_paper_ss, is_citation_list_complete,
+                              run_limited, install_stop_handler, CRAWL_CONCURRENCY)
+from http_service import is_negative_cached, save_negative_cache
+from storage import load_dict, save_dict
+from identity import get_identity_index, normalize_doi
+
+# crawl de vários saltos a partir das publicações de uma conferência: fronteira limitada,
+# expandida por prioridade (ligações com o que já foi visto, autoria lusófona, mesma venue)
+# e com as arestas gravadas nos dicts de citações e referências à medida que chegam
+CRAWL_FOLDER = os.path.join('data', 'crawl')
+REFERENCES_JSON_PATH = os.path.join('data', 'references.json')
+DIRECTIONS = ('citations', 'references')
+DEFAULT_MAX_DEPTH = 2
+DEFAULT_MAX_FRONTIER = 100000
+MAX_ATTEMPTS = 3
+BATCH_SIZE = 8
+SAVE_EVERY = 200
+
+IN_EDGE_WEIGHT = 1.0
+OUT_EDGE_WEIGHT = 0.5
+LUSOPHONE_BONUS = 5.0
+VENUE_BONUS = 5.0
+DEPTH_PENALTY = 10.0
+
+def get_nodes_path(crawl_name):
+    return os.path.join(CRAWL_FOLDER, f'{crawl_name}_nodes.json')
+
+def normalize_venue(venue):
+    return ' '.join((venue or '').casefold().split())
+
+def is_paper_id(key):
+    return key[:3] != '10.'
+
+def get_ss_neighbors(paper, direction):
+    # (chave, venue) de cada vizinho; sem doi utilizável, o paperId é a chave
+    neighbors = []
+    for entry in paper.get(direction) or []:
+        key = normalize_doi(entry.get('doi')) or entry.get('paperId')
+        if key is not None:
+            neighbors.append((key, entry.get('venue')))
+    return neighbors
+
+
+class Frontier:
+    def __init__(self, nodes, max_depth, max_frontier, venue_names=(), doi_dict=None, identities=None):
+        # nodes: chave -> estado do nó; um paperId que ganhou doi é fundido no nó do doi
+        self.nodes = nodes
+        self.identities = identities if identities is not None else get_identity_index()
+        self.max_depth = max_depth
+        self.max_frontier = max_frontier
+        self.venue_names = set(venue_names)
+        self.doi_dict = doi_dict if doi_dict is not None else dict()
+        self.heap = []
+        # a prioridade com que cada chave está no heap, para não empilhar a mesma entrada duas vezes
+        self.queued = dict()
+        self.size = 0
+        self.failed = set()
+        # chave do nó -> doi como está no dblp, a chave das publicações em citations no crawl de um salto
+        self.seed_keys = dict()
+        for key in nodes:
+            if self.is_open(key):
+                self.size += 1
+                self.push(key)
+
+    def __len__(self):
+        return self.size
+
+    def is_open(self, key):
+        node = self.nodes[key]
+        return not node['expanded'] and node.get('failures', 0) < MAX_ATTEMPTS and key not in self.failed
+
+    def resolve(self, key):
+        return self.identities.get_canonical(key)
+
+    def get_store_key(self, key):
+        return self.seed_keys.get(key, key)
+
+    def seed(self, doi):
+        key = self.resolve(doi)
+        self.seed_keys[key] = doi
+        self.discover(key, 0, venue=True)
+
+    def get_priority(self, key):
+        node = self.nodes[key]
+        score = IN_EDGE_WEIGHT * node['in_edges'] + OUT_EDGE_WEIGHT * node['out_edges'] - DEPTH_PENALTY * node['depth']
+        if node['venue']:
+            score += VENUE_BONUS
+        if self.doi_dict.get(key, dict()).get('authors_related_to_portuguese'):
+            score += LUSOPHONE_BONUS
+        return score
+
+    def push(self, key):
+        priority = self.get_priority(key)
+        if self.queued.get(key) == priority:
+            return
+        self.queued[key] = priority
+        heapq.heappush(self.heap, (-priority, key))
+
+    def pop(self):
+        # a prioridade muda com as arestas novas, entradas antigas no heap são descartadas aqui
+        while self.heap:
+            priority, key = heapq.heappop(self.heap)
+            if self.queued.get(key) != -priority:
+                continue
+            del self.queued[key]
+            if not self.is_open(key):
+                continue
+            if self.resolve(key) != key:
+                self.merge(key)
+                continue
+            return key
+        return None
+
+    def merge(self, key):
+        # o doi desse paperId apareceu depois que ele entrou na fronteira
+        node = self.nodes[key]
+        self.nodes[key] = dict(node, expanded=True, merged_into=self.resolve(key))
+        self.size -= 1
+        self.discover(self.resolve(key), node['depth'], venue=node['venue'] or None)
+
+    def discover(self, key, depth, direction=None, venue=None):
+        # direction é a lista do nó expandido em que o vizinho apareceu
+        if depth >= self.max_depth and key not in self.nodes:
+            return
+        node = self.nodes.get(key)
+        if node is None:
+            if self.size >= self.max_frontier:
+                return
+            node = { 'depth': depth, 'expanded': False, 'in_edges': 0, 'out_edges': 0, 'venue': False }
+            self.size += 1
+        elif not self.is_open(key):
+            return
+        else:
+            node = dict(node, depth=min(node['depth'], depth))
+        if direction == 'citations':
+            node['out_edges'] += 1
+        elif direction == 'references':
+            node['in_edges'] += 1
+        if venue is True or normalize_venue(venue) in self.venue_names:
+            node['venue'] = True
+        self.nodes[key] = node
+        self.push(key)
+
+    def finish(self, key):
+        if self.nodes[key]['expanded']:
+            return
+        node = dict(self.nodes[key], expanded=True)
+        node.pop('partial', None)
+        self.nodes[key] = node
+        self.size -= 1
+
+    def defer(self, key):
+        # expansão parcial: as arestas que vieram ficam, o nó continua aberto e volta na próxima execução
+        if key in self.failed:
+            return
+        self.nodes[key] = dict(self.nodes[key], partial=True)
+        self.failed.add(key)
+        self.size -= 1
+
+    def fail(self, key):
+        # não volta para o heap nesta execução; na próxima, até MAX_ATTEMPTS tentativas
+        if key in self.failed:
+            return
+        self.nodes[key] = dict(self.nodes[key], failures=self.nodes[key].get('failures', 0) + 1)
+        self.failed.add(key)
+        self.size -= 1
+
+async def get_empty_list():
+    return list()
+
+async def expand_node(key, directions, semaphores):
+    # ({direção: [(chave, venue)]}, completa), ou None se nenhuma fonte respondeu; a expansão
+    # só é completa se cada fonte respondeu ou não tem o artigo, como as listas do crawl de um salto
+    paper_id = is_paper_id(key)
+    paper, citing_dois_oc, cited_dois_oc = await asyncio.gather(
+        run_limited(semaphores, 'semanticscholar', read_paper_ss, key),
+        run_limited(semaphores, 'opencitations', get_citing_dois_oc, key) if 'citations' in directions and not paper_id else get_empty_list(),
+        run_limited(semaphores, 'opencitations', get_cited_dois_oc, key) if 'references' in directions and not paper_id else get_empty_list())
+
+    oc_lookups = [lookup for lookup, direction in (('oc_citations', 'citations'), ('oc_references', 'references')) if direction in directions]
+    complete = is_citation_list_complete(key, ['ss_citations'] + ([] if paper_id else oc_lookups))
+    if paper is None and (paper_id or all(is_negative_cached(lookup, key) for lookup in oc_lookups)) and not complete:
+        return None
+
+    neighbors = dict()
+    for direction, dois_oc in (('citations', citing_dois_oc), ('references', cited_dois_oc)):
+        if direction not in directions:
+            continue
+        direction_neighbors = get_ss_neighbors(paper, direction) if paper is not None else []
+        direction_neighbors += [(doi, None) for doi in dois_oc]
+        neighbors[direction] = direction_neighbors
+    return neighbors, complete
+
+def record_expansion(key, neighbors, frontier, citations, references, complete=True):
+    depth = frontier.nodes[key]['depth']
+    if complete:
+        frontier.finish(key)
+    else:
+        frontier.defer(key)
+    store_key = frontier.get_store_key(key)
+    for direction, direction_neighbors in neighbors.items():
+        # citations: citado -> citantes, references: citante -> citados
+        store = citations if direction == 'citations' else references
+        known_keys = set(store.get(store_key, []))
+        keys = []
+        for neighbor_key, venue in direction_neighbors:
+            neighbor_key = frontier.resolve(neighbor_key)
+            if neighbor_key == key:
+                continue
+            keys.append(neighbor_key)
+            # numa nova expansão de um nó parcial, as arestas já gravadas não contam de novo
+            frontier.discover(neighbor_key, depth + 1, direction if neighbor_key not in known_keys else None, venue)
+        store[store_key] = sorted(known_keys.union(keys))
+
+async def crawl_frontier(frontier, directions, citations, references, checkpoint, max_nodes=None):
+    semaphores = {service: asyncio.Semaphore(limit) for service, limit in CRAWL_CONCURRENCY.items()}
+    stop = asyncio.Event()
+    restore_stop_handler = install_stop_handler(stop)
+
+    expanded = 0
+    partial = 0
+    failed = 0
+    try:
+        while not stop.is_set() and (max_nodes is None or expanded + partial + failed < max_nodes):
+            batch = []
+            while len(batch) < BATCH_SIZE:
+                key = frontier.pop()
+                if key is None:
+                    break
+                batch.append(key)
+            if len(batch) == 0:
+                break
+
+            results = await asyncio.gather(*(expand_node(frontier.get_store_key(key), directions, semaphores) for key in batch))
+            for key, result in zip(batch, results):
+                if result is None:
+                    frontier.fail(key)
+                    failed += 1
+                    continue
+                neighbors, complete = result
+                record_expansion(key, neighbors, frontier, citations, references, complete)
+                if complete:
+                    expanded += 1
+                else:
+                    partial += 1
+            if (expanded + partial + failed) % SAVE_EVERY < len(batch):
+                checkpoint()
+    finally:
+        checkpoint()
+        restore_stop_handler()
+    return expanded, partial, failed
+
+def merge_lowercase_seed_key(doi, citations, references):
+    # execuções anteriores gravavam as publicações com o doi em minúsculas
+    if doi == doi.lower():
+        return
+    for store in (citations, references):
+        if doi.lower() in store:
+            store[doi] = sorted(set(store.get(doi, [])).union(store.pop(doi.lower())))
+
+def crawl_conference(conference_alias, max_depth=DEFAULT_MAX_DEPTH, max_frontier=DEFAULT_MAX_FRONTIER, directions=DIRECTIONS,
+                     max_nodes=None, crawl_name=None):
+    os.makedirs(CRAWL_FOLDER, exist_ok=True)
+    nodes_path = get_nodes_path(crawl_name or f'{conference_alias}_{max_depth}')
+    citations_json_path = os.path.join('data', 'citations.json')
+    citations = load_dict(citations_json_path)
+    references = load_dict(REFERENCES_JSON_PATH)
+    doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
+    nodes = load_dict(nodes_path)
+
+    publications = list(iter_conference(conference_alias))
+    venue_names = {normalize_venue(publication['info'].get('venue')) for publication in publications} - {''}
+    frontier = Frontier(nodes, max_depth, max_frontier, venue_names, doi_dict)
+    for doi in dict.fromkeys(doi for doi in map(get_doi, publications) if doi is not None):
+        frontier.seed(doi)
+        merge_lowercase_seed_key(doi, citations, references)
+
+    def checkpoint():
+        # as arestas antes do estado dos nós: um nó só aparece como expandido com as arestas no disco
+        save_dict(citations, citations_json_path)
+        save_dict(references, REFERENCES_JSON_PATH)
+        frontier.identities.save()
+        save_negative_cache()
+        save_dict(nodes, nodes_path)
+
+    expanded, partial, failed = asyncio.run(crawl_frontier(frontier, directions, citations, references, checkpoint, max_nodes))
+    print(f'{expanded} nós expandidos, {partial} parciais para a próxima execução, {failed} falharam, {len(frontier)} na fronteira')
+    return frontier
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl de citações e referências em vários saltos a partir de uma conferência')
+    parser.add_argument('conference', help='alias dblp, ex.: sbsi_new')
+    parser.add_argument('--depth', type=int, default=DEFAULT_MAX_DEPTH, help='saltos a partir das publicações da conferência')
+    parser.add_argument('--max-frontier', type=int, default=DEFAULT_MAX_FRONTIER, help='máximo de nós esperando expansão')
+    parser.add_argument('--max-nodes', type=int, help='máximo de nós expandidos nesta execução')
+    parser.add_argument('--directions', nargs='+', choices=DIRECTIONS, default=list(DIRECTIONS))
+    parser.add_argument('--name', help='nome do estado do crawl em data/crawl, padrão <conferência>_<profundidade>')
+    args = parser.parse_args()
+
+    crawl_conference(args.conference, args.depth, args.max_frontier, tuple(args.directions), args.max_nodes, args.name)
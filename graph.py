@@ -0,0 +1,217 @@
+import os
+import numpy as np
+from xml.sax.saxutils import quoteattr
+from storage import load_dict, save_dict, atomic_writer
+
+# grafo de citações persistente: arestas (citado -> citantes) e a categoria de cada nó ficam
+# em data/graph/<nome>_*.json; a cada execução só o que mudou é aplicado e gravado
+GRAPH_FOLDER = os.path.join('data', 'graph')
+
+NODE_COLORS = {
+    'nosso_pt':                     {'r':   0, 'g': 255, 'b':   0, 'a': 1},
+    'nosso_en':                     {'r':   0, 'g':   0, 'b': 255, 'a': 1},
+    'externo_autoria_pt':           {'r': 255, 'g': 255, 'b':   0, 'a': 1},
+    'externo_autoria_nao_pt':       {'r': 255, 'g':   0, 'b': 255, 'a': 1},
+    'externo_autoria_desconhecida': {'r': 255, 'g':   0, 'b':   0, 'a': 1},
+}
+
+PUBLICATION_CATEGORIES = ('nosso_pt', 'nosso_en')
+
+def get_graph_paths(graph_name):
+    return (os.path.join(GRAPH_FOLDER, f'{graph_name}_nodes.json'),
+            os.path.join(GRAPH_FOLDER, f'{graph_name}_edges.json'))
+
+def load_graph(graph_name):
+    nodes_path, edges_path = get_graph_paths(graph_name)
+    return load_dict(nodes_path), load_dict(edges_path)
+
+def save_graph(graph_name, nodes, edges):
+    os.makedirs(GRAPH_FOLDER, exist_ok=True)
+    nodes_path, edges_path = get_graph_paths(graph_name)
+    save_dict(nodes, nodes_path)
+    save_dict(edges, edges_path)
+
+def get_citer_category(citing_doi, doi_dict):
+    verdict = doi_dict[citing_doi].get('authors_related_to_portuguese') if citing_doi in doi_dict else None
+    if verdict is None:
+        return 'externo_autoria_desconhecida'
+    return 'externo_autoria_pt' if verdict else 'externo_autoria_nao_pt'
+
+def get_publication_category(publication):
+    return 'nosso_pt' if publication['language'] == 'pt-br' else 'nosso_en'
+
+def update_citation_graph(publications, citations, doi_dict, nodes, edges, identities=None):
+    # o grafo gravado é o retrato da última atualização: a lista canônica de citantes de cada
+    # publicação em edges e a categoria de cada nó em nodes. A cada execução esse retrato é
+    # comparado com os dados atuais e só a diferença é aplicada, venha ela do crawl, do crawl.py,
+    # de classifier.py/review.py ou de um paperId que virou alias no identity.py
+    delta = { 'nodes': 0, 'edges': 0 }
+
+    def set_category(node, category):
+        if nodes.get(node) != category:
+            nodes[node] = category
+            delta['nodes'] += 1
+
+    publication_nodes = dict()
+    for publication in publications:
+        doi = publication['info'].get('doi')
+        if doi is not None:
+            publication_nodes[doi.lower()] = (doi, publication)
+
+    for cited_doi in [cited_doi for cited_doi in edges if cited_doi not in publication_nodes]:
+        delta['edges'] += len(edges.pop(cited_doi))
+
+    citers = set()
+    for node, (doi, publication) in publication_nodes.items():
+        citing_dois = list(citations.get(doi, [])) if identities is None else identities.canonicalize(citations.get(doi, []))
+        previous_dois = edges.get(node, [])
+        if previous_dois != citing_dois:
+            delta['edges'] += len(set(citing_dois).symmetric_difference(previous_dois))
+            edges[node] = citing_dois
+        citers.update(citing_dois)
+
+    # nós que nenhuma publicação cita mais (aliases, citações removidas) saem do grafo
+    for node in [node for node in nodes if node not in publication_nodes and node not in citers]:
+        del nodes[node]
+        delta['nodes'] += 1
+
+    # as publicações da conferência têm prioridade sobre a cor de citante
+    for node, (doi, publication) in publication_nodes.items():
+        set_category(node, get_publication_category(publication))
+    for citing_doi in citers:
+        if citing_doi not in publication_nodes:
+            set_category(citing_doi, get_citer_category(citing_doi, doi_dict))
+    return delta
+
+def iter_graph_edges(edges):
+    for cited_doi, citing_dois in edges.items():
+        for citing_doi in citing_dois:
+            yield citing_doi, cited_doi
+
+def write_gexf(nodes, edges, file_path):
+    with atomic_writer(file_path) as output_file:
+        output_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:viz="http://www.gexf.net/1.2draft/viz" version="1.2">\n'
+                          '  <graph defaultedgetype="directed" mode="static">\n'
+                          '    <nodes>\n')
+        for node, category in nodes.items():
+            color = NODE_COLORS[category]
+            output_file.write(f'      <node id={quoteattr(node)} label={quoteattr(node)}>'
+                              f'<viz:color r="{color["r"]}" g="{color["g"]}" b="{color["b"]}" a="{color["a"]}" /></node>\n')
+        output_file.write('    </nodes>\n'
+                          '    <edges>\n')
+        for edge_id, (source, target) in enumerate(iter_graph_edges(edges)):
+            output_file.write(f'      <edge id="{edge_id}" source={quoteattr(source)} target={quoteattr(target)} />\n')
+        output_file.write('    </edges>\n'
+                          '  </graph>\n'
+                          '</gexf>\n')
+
+def write_graphml(nodes, edges, file_path):
+    with atomic_writer(file_path) as output_file:
+        output_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                          '  <key id="category" for="node" attr.name="category" attr.type="string" />\n'
+                          '  <key id="r" for="node" attr.name="r" attr.type="int" />\n'
+                          '  <key id="g" for="node" attr.name="g" attr.type="int" />\n'
+                          '  <key id="b" for="node" attr.name="b" attr.type="int" />\n'
+                          '  <graph edgedefault="directed">\n')
+        for node, category in nodes.items():
+            color = NODE_COLORS[category]
+            output_file.write(f'    <node id={quoteattr(node)}><data key="category">{category}</data>'
+                              f'<data key="r">{color["r"]}</data><data key="g">{color["g"]}</data><data key="b">{color["b"]}</data></node>\n')
+        for source, target in iter_graph_edges(edges):
+            output_file.write(f'    <edge source={quoteattr(source)} target={quoteattr(target)} />\n')
+        output_file.write('  </graph>\n'
+                          '</graphml>\n')
+
+
+# representação em arrays para grafos grandes: ids inteiros, categorias internadas em int8
+# e adjacência CSR (de saída e de entrada) em numpy; as métricas são vetorizadas
+CATEGORY_NAMES = list(NODE_COLORS)
+CATEGORY_CODES = {category: code for code, category in enumerate(CATEGORY_NAMES)}
+
+
+class ArrayGraph:
+    def __init__(self, node_names, categories, sources, targets):
+        self.node_names = node_names
+        self.node_index = {node: node_id for node_id, node in enumerate(node_names)}
+        self.categories = categories
+        self.sources = sources
+        self.targets = targets
+        self.out_indptr, self.out_indices = build_csr(sources, targets, len(node_names))
+        self.in_indptr, self.in_indices = build_csr(targets, sources, len(node_names))
+
+    def __len__(self):
+        return len(self.node_names)
+
+    def out_neighbors(self, node):
+        node_id = self.node_index[node]
+        return [self.node_names[i] for i in self.out_indices[self.out_indptr[node_id]:self.out_indptr[node_id + 1]]]
+
+    def in_neighbors(self, node):
+        node_id = self.node_index[node]
+        return [self.node_names[i] for i in self.in_indices[self.in_indptr[node_id]:self.in_indptr[node_id + 1]]]
+
+def build_csr(rows, columns, node_count):
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=node_count), out=indptr[1:])
+    return indptr, columns[order]
+
+def build_array_graph(nodes, edges):
+    node_index = dict()
+    node_names = []
+
+    def intern(node):
+        if node not in node_index:
+            node_index[node] = len(node_names)
+            node_names.append(node)
+        return node_index[node]
+
+    for node in nodes:
+        intern(node)
+    pairs = np.fromiter((value for source, target in iter_graph_edges(edges) for value in (intern(source), intern(target))), dtype=np.int64)
+    pairs = np.unique(pairs.reshape(-1, 2), axis=0) if len(pairs) > 0 else pairs.reshape(0, 2)
+
+    unknown_code = CATEGORY_CODES['externo_autoria_desconhecida']
+    categories = np.fromiter((CATEGORY_CODES[nodes[node]] if node in nodes else unknown_code for node in node_names), dtype=np.int8, count=len(node_names))
+    return ArrayGraph(node_names, categories, pairs[:, 0].astype(np.int32), pairs[:, 1].astype(np.int32))
+
+def in_degree_by_category(graph):
+    # matriz nós × categoria do citante
+    category_count = len(CATEGORY_NAMES)
+    flat = graph.targets.astype(np.int64) * category_count + graph.categories[graph.sources]
+    return np.bincount(flat, minlength=len(graph) * category_count).reshape(len(graph), category_count)
+
+def pagerank(graph, damping=0.85, tolerance=1e-10, max_iterations=100):
+    node_count = len(graph)
+    if node_count == 0:
+        return np.zeros(0)
+    out_degree = np.bincount(graph.sources, minlength=node_count).astype(np.float64)
+    dangling = out_degree == 0
+    ranks = np.full(node_count, 1.0 / node_count)
+    for _ in range(max_iterations):
+        contributions = np.divide(ranks, out_degree, out=np.zeros(node_count), where=~dangling)
+        new_ranks = np.bincount(graph.targets, weights=contributions[graph.sources], minlength=node_count)
+        new_ranks = damping * (new_ranks + ranks[dangling].sum() / node_count) + (1.0 - damping) / node_count
+        converged = np.abs(new_ranks - ranks).sum() < tolerance
+        ranks = new_ranks
+        if converged:
+            break
+    return ranks
+
+def language_citation_reach(graph):
+    # para as publicações de cada idioma: citações recebidas e citantes distintos por categoria
+    reach = dict()
+    for language_category in PUBLICATION_CATEGORIES:
+        edge_mask = graph.categories[graph.targets] == CATEGORY_CODES[language_category]
+        citing = graph.sources[edge_mask]
+        unique_citing = np.unique(citing)
+        reach[language_category] = {
+            'publications': int((graph.categories == CATEGORY_CODES[language_category]).sum()),
+            'citations': int(edge_mask.sum()),
+            'citers': int(len(unique_citing)),
+            'citers_by_category': {CATEGORY_NAMES[code]: int(count) for code, count in
+                                   enumerate(np.bincount(graph.categories[unique_citing], minlength=len(CATEGORY_NAMES))) if count > 0},
+        }
+    return reach
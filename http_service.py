@@ -0,0 +1,208 @@
+import requests
+import requests.adapters
+import os
+import json
+import time
+import random
+import threading
+import email.utils
+from urllib.parse import urlsplit
+from storage import load_dict, save_dict
+
+secrets = dict()
+if os.path.isfile('secret.json'):
+    with open('secret.json', 'r') as input_file:
+        secrets = json.load(input_file)
+
+# e-mail de contato, o crossref manda para o "polite pool" quem se identifica
+CONTACT_EMAIL = secrets.get('contact_email')
+USER_AGENT = 'anresoc20231/1.0' + (f' (mailto:{CONTACT_EMAIL})' if CONTACT_EMAIL else '')
+
+# requisições por segundo permitidas para cada host
+HOST_RATE_LIMITS = {
+    'api.crossref.org': 50 if CONTACT_EMAIL else 10,
+    'api.datacite.org': 10,
+    'api.semanticscholar.org': 1,
+    'opencitations.net': 3,
+    'dblp.org': 2,
+    'pub.orcid.org': 12,
+}
+DEFAULT_RATE_LIMIT = 5
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+DEFAULT_TIMEOUT = 30
+POOL_MAXSIZE = 32
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_time)
+            self.next_time = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def penalize(self, delay):
+        # empurra o próximo horário livre do host, todas as threads esperam juntas
+        with self.lock:
+            self.next_time = max(self.next_time, time.monotonic() + delay)
+
+
+session = requests.Session()
+session.headers.update({ 'User-Agent': USER_AGENT })
+adapter = requests.adapters.HTTPAdapter(pool_connections=len(HOST_RATE_LIMITS) + 4, pool_maxsize=POOL_MAXSIZE)
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+rate_limiters = dict()
+rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(host):
+    with rate_limiters_lock:
+        if host not in rate_limiters:
+            rate_limiters[host] = RateLimiter(HOST_RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT))
+        return rate_limiters[host]
+
+def parse_retry_after(response):
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+def get_backoff(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+def http_get(url, headers=None, timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES, **kwargs):
+    host = urlsplit(url).hostname
+    rate_limiter = get_rate_limiter(host)
+    attempt = 0
+    while True:
+        rate_limiter.wait()
+        try:
+            response = session.get(url, headers=headers, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt >= max_retries:
+                raise
+            time.sleep(get_backoff(attempt))
+            attempt += 1
+            continue
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+            return response
+
+        delay = parse_retry_after(response)
+        if delay is None:
+            delay = get_backoff(attempt)
+        else:
+            delay = min(delay, BACKOFF_MAX)
+        rate_limiter.penalize(delay)
+        response.close()
+        attempt += 1
+
+
+# cache de falhas: buscas que falharam não são repetidas antes do ttl do tipo de falha;
+# 404 e respostas inválidas são tratados como (quase) permanentes, o resto é transitório
+NEGATIVE_CACHE_JSON_PATH = os.path.join('data', 'negative_cache.json')
+HOUR = 60 * 60
+DAY = 24 * HOUR
+NEGATIVE_CACHE_TTLS = {
+    'not_found': 30 * DAY,
+    'client_error': 30 * DAY,
+    'bad_payload': 7 * DAY,
+    'server_error': 6 * HOUR,
+    'rate_limited': HOUR,
+    'timeout': HOUR,
+    'connection': HOUR,
+    'error': DAY,
+}
+
+# falhas que não mudam ao repetir a busca logo depois: a fonte respondeu que não tem o item
+PERMANENT_FAILURE_KINDS = ('not_found', 'client_error', 'bad_payload')
+
+negative_cache = None
+negative_cache_lock = threading.RLock()
+# o cache é alterado em memória e gravado por save_negative_cache nos checkpoints do crawl
+negative_cache_dirty = False
+
+def get_negative_cache():
+    global negative_cache
+    with negative_cache_lock:
+        if negative_cache is None:
+            negative_cache = load_dict(NEGATIVE_CACHE_JSON_PATH)
+    return negative_cache
+
+def get_failure_kind(err):
+    if isinstance(err, str):
+        return err
+    response = getattr(err, 'response', None)
+    if isinstance(err, requests.exceptions.HTTPError) and response is not None:
+        if response.status_code in (404, 410):
+            return 'not_found'
+        if response.status_code == 429:
+            return 'rate_limited'
+        if response.status_code >= 500:
+            return 'server_error'
+        return 'client_error'
+    if isinstance(err, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(err, requests.exceptions.ConnectionError):
+        return 'connection'
+    if isinstance(err, (ValueError, KeyError, TypeError)):
+        return 'bad_payload'
+    return 'error'
+
+def get_cached_failure(lookup, key):
+    # o tipo da falha enquanto ela está no ttl, senão None
+    entry = get_negative_cache().get(f'{lookup}:{key}')
+    if entry is None or time.time() - entry['time'] >= NEGATIVE_CACHE_TTLS.get(entry['kind'], DAY):
+        return None
+    return entry['kind']
+
+def is_negative_cached(lookup, key):
+    return get_cached_failure(lookup, key) is not None
+
+def record_failure(lookup, key, err):
+    global negative_cache_dirty
+    kind = get_failure_kind(err)
+    with negative_cache_lock:
+        cache = get_negative_cache()
+        previous = cache.get(f'{lookup}:{key}', dict())
+        cache[f'{lookup}:{key}'] = {
+            'kind': kind,
+            'time': time.time(),
+            'count': previous.get('count', 0) + 1
+        }
+        negative_cache_dirty = True
+    return kind
+
+def clear_failure(lookup, key):
+    global negative_cache_dirty
+    with negative_cache_lock:
+        cache = get_negative_cache()
+        if f'{lookup}:{key}' in cache:
+            del cache[f'{lookup}:{key}']
+            negative_cache_dirty = True
+
+def save_negative_cache():
+    global negative_cache_dirty
+    with negative_cache_lock:
+        if negative_cache_dirty:
+            save_dict(negative_cache, NEGATIVE_CACHE_JSON_PATH)
+            negative_cache_dirty = False
@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+from storage import load_dict, save_dict, iter_dict_items
+
+# índice de identidade: cada artigo tem uma chave canônica, o doi quando se conhece um e senão
+# o paperId do semantic scholar; paperIds e outros ids externos (arxiv:..., corpusid:...) apontam
+# para ela, para que o mesmo artigo não vire dois nós nem seja buscado e contado duas vezes
+IDENTITIES_JSON_PATH = os.path.join('data', 'identities.json')
+SS_EXTERNAL_ID_FIELDS = {
+    'arxivId': 'arxiv',
+    'corpusId': 'corpusid',
+}
+
+def is_doi(key):
+    return key[:3] == '10.'
+
+def normalize_doi(doi):
+    # o semantic scholar devolve 'null' e dois de exemplo (10.5555) em vez de nada
+    if doi in (None, 'null') or doi[:7] == '10.5555':
+        return None
+    return doi.lower()
+
+
+class IdentityIndex:
+    def __init__(self, file_json_path=IDENTITIES_JSON_PATH):
+        self.file_json_path = file_json_path
+        self.aliases = load_dict(file_json_path)
+        self.lock = threading.Lock()
+
+    def get_canonical(self, key):
+        if key is None:
+            return None
+        key = key.lower()
+        # no máximo dois saltos: id externo -> paperId -> doi
+        while key in self.aliases:
+            key = self.aliases[key]
+        return key
+
+    def canonicalize(self, keys):
+        return list(dict.fromkeys(self.get_canonical(key) for key in keys))
+
+    def link(self, doi=None, paper_id=None, external_ids=()):
+        doi = normalize_doi(doi)
+        aliases = [alias.lower() for alias in (paper_id, *external_ids) if alias is not None]
+        if doi is None and len(aliases) == 0:
+            return None
+        with self.lock:
+            canonical = doi if doi is not None else self.get_canonical(aliases[0])
+            for alias in aliases:
+                current = self.get_canonical(alias)
+                if current == canonical:
+                    continue
+                if current != alias and is_doi(current):
+                    # já ligado a outro doi (preprint e versão publicada, por ex.), o primeiro fica
+                    continue
+                self.aliases[current if current != alias else alias] = canonical
+            return self.get_canonical(aliases[0]) if len(aliases) > 0 else canonical
+
+    def link_paper_ss(self, paper):
+        # resposta de /v1/paper, ou uma entrada das listas de citações e referências dela
+        external_ids = [f'{prefix}:{paper[field]}' for field, prefix in SS_EXTERNAL_ID_FIELDS.items() if paper.get(field) is not None]
+        return self.link(paper.get('doi'), paper.get('paperId'), external_ids)
+
+    def save(self):
+        with self.lock:
+            save_dict(self.aliases, self.file_json_path)
+
+identity_index = None
+identity_index_lock = threading.Lock()
+
+def get_identity_index():
+    global identity_index
+    with identity_index_lock:
+        if identity_index is None:
+            identity_index = IdentityIndex()
+    return identity_index
+
+def learn_from_doi_items(doi_items, identities):
+    # entradas de paperId com metadados do semantic scholar já trazem o doi
+    learned = 0
+    for key, doi_entry in doi_items:
+        if not is_doi(key) and doi_entry.get('agency') == 'semanticscholar' and 'metadata' in doi_entry:
+            if identities.link_paper_ss(doi_entry['metadata']) != key:
+                learned += 1
+    return learned
+
+def canonicalize_citations(citations, identities):
+    changed = 0
+    for doi, citing_dois in citations.items():
+        canonical_dois = identities.canonicalize(citing_dois)
+        if canonical_dois != citing_dois:
+            citations[doi] = canonical_dois
+            changed += 1
+    return changed
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+    if command == 'rebuild':
+        identities = get_identity_index()
+        # o doi_metadata é lido em streaming, só as entradas de paperId interessam
+        doi_items = iter_dict_items(os.path.join('data', 'doi_metadata.json'))
+        print(f'{learn_from_doi_items(doi_items, identities)} paperIds ligados a dois')
+        identities.save()
+        citations_json_path = os.path.join('data', 'citations.json')
+        citations = load_dict(citations_json_path)
+        print(f'{canonicalize_citations(citations, identities)} listas de citantes reescritas')
+        save_dict(citations, citations_json_path)
+    else:
+        print('uso: python identity.py [rebuild]')
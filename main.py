@@ -1,127 +1,30 @@
 #%%
 import requests
-import math
+import asyncio
 import json
 import os
-import fasttext
+import sys
+import threading
 import xml.etree.ElementTree as ET
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from scholarly import scholarly
-#from orcid_service import load_orcid
+from orcid_service import load_orcid, load_orcids
+from http_service import http_get, is_negative_cached, get_cached_failure, record_failure, clear_failure, save_negative_cache
+from conference import iter_conference, get_doi
+from citation_service import get_citing_dois_oc, get_citing_dois_and_pids_ss, is_citation_list_complete, CRAWL_CONCURRENCY, run_limited, install_stop_handler
+from storage import load_dict, save_dict
+import review
+from title_index import TitleIndex
+from work_queue import WorkQueue
+from identity import get_identity_index
+from graph import load_graph, save_graph, update_citation_graph, write_gexf, build_array_graph, language_citation_reach
+from classifier import (ORCID_REGEX, clean_affiliation, classify_affiliation_text,
+                        classify_orcid_record, get_orcid_biography, get_orcid_id_from_url, classify_doi)
 import urllib
-import networkx as nx
 import pandas as pd
 import matplotlib.pyplot as plt
 
-fasttext_model = fasttext.load_model('lid.176.ftz')
-
-REMOVE_ACCENTS_TRANSLATION = str.maketrans('áéíóúàèìòùãõâêîôû', 'aeiouaeiouaoaeiou')
-PORTUGUESE_COUNTRIES_CASEFOLDED = ('mozambique', 'mocambique', 'moçambique', 'brazil', 'brasil', 'angola', 'cabo verde', 'cape verde', 
-                                   'macau', 'timor leste', 'east timor', 'equatorial guinea', 'guine-bissau', 'guinea-bissau', 'portugal')
-COUNTRIES_CASEFOLDED = ('afghanistan', 'aland islands', 'albania', 'algeria', 'american samoa', 'andorra', 'angola', 'anguilla', 
-                        'antarctica', 'antigua and barbuda', 'argentina', 'armenia', 'aruba', 'australia', 'austria', 'azerbaijan', 
-                        'bahamas', 'bahrain', 'bangladesh', 'barbados', 'belarus', 'belgium', 'belize', 'benin', 'bermuda', 'bhutan', 
-                        'bolivia', 'bonaire', 'bosnia and herzegovina', 'bosnia', 'herzegovina', 'botswana', 
-                        'bouvet', 'british indian ocean territory', 'brunei', 'bulgaria', 'burkina faso', 
-                        'burundi', 'cambodia', 'cameroon', 'canada', 'cayman islands', 'central african republic', 'chad', 
-                        'chile', 'china', 'christmas island', 'cocos (keeling) islands', 'keeling', 'colombia', 'comoros', 'congo', 'cook islands', 
-                        'costa rica', "côte d'ivoire", 'croatia', 'cuba', 'curaçao', 'curacao', 'cyprus', 'czechia', 'denmark', 'djibouti', 
-                        'dominica', 'dominican republic', 'ecuador', 'egypt', 'el salvador', 'equatorial guinea', 'eritrea', 'estonia', 
-                        'ethiopia', 'falkland islands', 'malvinas', 'faroe islands', 'fiji', 'finland', 'france', 'french guiana', 
-                        'french polynesia', 'french southern territories', 'gabon', 'gambia', 'georgia', 'germany', 'ghana', 'gibraltar', 
-                        'greece', 'greenland', 'grenada', 'guadeloupe', 'guam', 'guatemala', 'guernsey', 'guinea', 'guinea-bissau', 
-                        'guyana', 'haiti', 'heard island and mcdonald islands', 'holy see', 'honduras', 'hong kong', 'hungary', 'iceland', 
-                        'india', 'indonesia', 'iran, islamic republic of', 'iraq', 'ireland', 'isle of man', 'israel', 'italy', 'jamaica', 
-                        'japan', 'jersey', 'jordan', 'kazakhstan', 'kenya', 'kiribati', "korea, democratic people's republic of", 
-                        'korea, republic of', 'kosovo', 'kuwait', 'kyrgyzstan', "lao people's democratic republic", 'laos', 'latvia', 'lebanon', 
-                        'lesotho', 'liberia', 'libya', 'liechtenstein', 'lithuania', 'luxembourg', 'macao', 'north macedonia', 'madagascar', 
-                        'malawi', 'malaysia', 'maldives', 'mali', 'malta', 'marshall islands', 'martinique', 'mauritania', 'mauritius', 
-                        'mayotte', 'mexico', 'micronesia, federated states of', 'moldova, republic of', 'monaco', 'mongolia', 'montenegro', 
-                        'montserrat', 'morocco', 'mozambique', 'myanmar', 'namibia', 'nauru', 'nepal', 'netherlands', 'new caledonia', 'new zealand', 
-                        'nicaragua', 'niger', 'nigeria', 'niue', 'norfolk island', 'northern mariana islands', 'norway', 'oman', 'pakistan', 
-                        'palau', 'palestine, state of', 'panama', 'papua new guinea', 'paraguay', 'peru', 'philippines', 'pitcairn', 
-                        'poland', 'puerto rico', 'qatar', 'reunion', 'romania', 'russian federation', 'rwanda', 'saint barthélemy', 
-                        'saint helena, ascension and tristan da cunha', 'saint kitts and nevis', 'saint lucia', 'saint martin (french part)', 
-                        'saint pierre and miquelon', 'saint vincent and the grenadines', 'samoa', 'san marino', 'sao tome and principe', 
-                        'saudi arabia', 'senegal', 'serbia', 'seychelles', 'sierra leone', 'singapore', 'sint maarten (dutch part)', 
-                        'slovakia', 'slovenia', 'solomon islands', 'somalia', 'south africa', 'south georgia and the south sandwich islands', 
-                        'south sudan', 'spain', 'sri lanka', 'sudan', 'suriname', 'svalbard and jan mayen', 'eswatini', 'sweden', 
-                        'switzerland', 'syrian arab republic', 'taiwan, province of china', 'tajikistan', 'tanzania, united republic of', 
-                        'thailand', 'timor-leste', 'togo', 'tokelau', 'tonga', 'trinidad and tobago', 'tunisia', 'türkiye', 'turkmenistan', 
-                        'turks and caicos islands', 'tuvalu', 'uganda', 'ukraine', 'united arab emirates', 'united kingdom of great britain and northern ireland', 
-                        'great britain', 'northern ireland', 'ireland',
-                        'united states of america', 'united states minor outlying islands', 'uruguay', 'uzbekistan', 'vanuatu', 
-                        'venezuela, bolivarian republic of', 'viet nam', 'virgin islands, british', 'virgin islands, u.s.', 'wallis and futuna', 
-                        'western sahara', 'yemen', 'zambia', 'zimbabwe', 'united states', 'iran', 'united kingdom', 'turkey', 'itally', 'russia')
-BRAZILIAN_STATES_CASEFOLDED = tuple(x.casefold() for x in ['Acre',
-'alagoas',
-'amapa',
-'amazonas',
-'bahia',
-'Ceara',
-'Distrito Federal',
-'Espirito Santo',
-'Goias',
-'Maranhao',
-'Mato Grosso',
-'Mato Grosso do Sul',
-'Minas Gerais',
-'Para',
-'Paraiba',
-'Parana',
-'Pernambuco',
-'Piaui',
-'Rio de Janeiro',
-'Rio Grande do Norte',
-'Rio Grande do Sul',
-'Rondonia',
-'Roraima',
-'Santa Catarina',
-'Sao Paulo',
-'Sergipe',
-'Tocantins'])
-
-def download_conference(conference_alias):
-    publications = []
-    try:
-        response = requests.get('https://dblp.org/search/publ/api?q=stream:conf/{0}:&format=json&h=0'.format(conference_alias))
-        response.raise_for_status()
-        publications_count = int(response.json()['result']['hits']['@total'])
-        h = 100
-        for f in range(int(math.ceil(publications_count/h))):
-            response = requests.get('https://dblp.org/search/publ/api?q=stream:conf/{0}:&format=json&h={1}&f={2}'.format(conference_alias, h, f*h))
-            response.raise_for_status()
-            publications = publications + response.json()['result']['hits']['hit']
-
-    except Exception as err:
-        print('Erro ocorrido1: {0}'.format(err))
-        traceback.print_exc()
-        return None
-    
-    publications[:] = map(classify_publication_language, publications)
-    return publications
-
-def save_conference_locally(conference_alias, conference=None):
-    if conference is None:
-        conference = download_conference(conference_alias)
-    conference_json = json.dumps(conference, indent=4)
-    with open('conferences/{0}.json'.format(conference_alias), 'w') as output_file:
-        output_file.write(conference_json)
-
-def load_conference(conference_alias, force=False):
-    if force or not os.path.isfile('conferences/{0}.json'.format(conference_alias)):
-        save_conference_locally(conference_alias)
-    with open('conferences/{0}.json'.format(conference_alias), 'r') as input_file:
-        return json.load(input_file)
-
-def classify_publication_language_fasttext(publication):
-    language = fasttext_model.predict(publication['info']['title'].split('[')[0], k=1)[0][0]
-    publication['language'] = language
-    return publication
-
-def classify_publication_language(publication):
-    return classify_publication_language_fasttext(publication)
-
 def prepare_folders():
     os.makedirs('conferences', exist_ok = True)
     os.makedirs('authors', exist_ok = True)
@@ -129,7 +32,7 @@ def prepare_folders():
 
 def get_author_affiliations_dblp(author_pid):
     try:
-        response = requests.get(f'https://dblp.org/pid/{author_pid}.xml', headers={ 'Accept': 'application/xml' })
+        response = http_get(f'https://dblp.org/pid/{author_pid}.xml', headers={ 'Accept': 'application/xml' })
         response.raise_for_status()
         tree = ET.ElementTree(ET.fromstring(response.content))
         notes = tree.findall("person/note[@type='affiliation']")
@@ -164,18 +67,6 @@ def load_authors_from_publications(publications):
                 affiliations = get_author_affiliations_dblp(pid)
     return author_map
 
-def load_dict(file_json_path):
-    if os.path.isfile(file_json_path):
-        with open(file_json_path, 'r') as input_file:
-            return json.load(input_file)
-    else:
-        return dict()
-
-def save_dict(json_dict, file_json_path):
-    json_str = json.dumps(json_dict, indent=4)
-    with open(file_json_path, 'w') as output_file:
-        output_file.write(json_str)
-
 def load_authorship_from_doi(doi, doi_dict=None, doi_author_dict=None):
     if doi_dict is None:
         doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
@@ -183,79 +74,87 @@ def load_authorship_from_doi(doi, doi_dict=None, doi_author_dict=None):
         doi_author_dict = load_dict(os.path.join('data', 'doi_author.json'))
 
 
-def get_citing_dois_oc(doi):
-    try:
-        response = requests.get(f'https://opencitations.net/index/api/v1/citations/{doi}', headers={ 'Accept': 'application/json' })
-        response.raise_for_status()
-    except Exception as err:
-        print('Erro ocorrido3: {0}'.format(err))
-        traceback.print_exc()
-        return list()
-
-    citations = [citation['citing'] for citation in response.json()]
-
-    if len(citations) == 0:
-        return list()
-
-    citing_dois = set()
-    for citation in citations:
-        citing_dois.update([x.split('=>')[1].strip().lower() for x in citation.split(';')])
-
-    return list(citing_dois)
-
-def get_citing_dois_and_pids_ss(doi):
-    try:
-        response = requests.get(f'https://api.semanticscholar.org/v1/paper/{doi}', headers={ 'Accept': 'application/json' })
-        response.raise_for_status()
-    except Exception as err:
-
-        # print('Erro ocorrido4: {0}'.format(err))
-        # traceback.print_exc()
-        return list(), list()
-
-    citations = response.json()['citations']
-
-    if len(citations) == 0:
-        return list(), list()
-
-    citing_dois = set()
-    citing_pids = set()
-    for citation in citations:
-
-        if citation['doi'] == 'null' or citation['doi'] == None:
-            citing_pids.update([citation['paperId'].lower()])
-            continue
-        
-        if citation['doi'][:7] == '10.5555':
-            print(f'burro:{citation["doi"]}')
-            continue
-
-        citing_dois.update([citation['doi'].lower()])
-
-    return list(citing_dois), list(citing_pids)
-
-def get_doi(publication):
-    return publication.get('info', {}).get('doi', None)
+OC_METADATA_URL = 'https://opencitations.net/index/api/v1/metadata/'
+OC_MAX_URL_LENGTH = 2000
+OC_MAX_CHUNK_SIZE = 100
+
+def has_metadata(doi_entry):
+    # metadado que basta para classificar: o da agência, ou o do opencitations quando todos os
+    # autores têm orcid; ele não traz afiliações, e autores sem orcid ficariam desconhecidos
+    if 'metadata' in doi_entry:
+        return True
+    if 'metadata_oc' not in doi_entry:
+        return False
+    authors_raw = [author_raw for author_raw in (doi_entry['metadata_oc'].get('author') or '').split(';') if author_raw.strip() != '']
+    return len(authors_raw) > 0 and all(ORCID_REGEX.search(author_raw) for author_raw in authors_raw)
+
+def needs_oc_metadata(doi, doi_entry):
+    return doi[:3] == '10.' and 'metadata_oc' not in doi_entry and not has_metadata(doi_entry)
+
+def is_metadata_resolved(doi_entry):
+    # agência sem busca de metadados (medra, jalc, ...): o do opencitations é o que há
+    if has_metadata(doi_entry):
+        return True
+    return 'metadata_oc' in doi_entry and doi_entry.get('agency') is not None and doi_entry['agency'] not in METADATA_LOADERS
+
+def chunk_dois_for_url(dois, base_url=OC_METADATA_URL, max_url_length=OC_MAX_URL_LENGTH, max_chunk_size=OC_MAX_CHUNK_SIZE):
+    chunks = []
+    chunk = []
+    url_length = len(base_url)
+    for doi in dois:
+        doi_length = len(urllib.parse.quote(doi, safe='/')) + (2 if chunk else 0)
+        if chunk and (url_length + doi_length > max_url_length or len(chunk) >= max_chunk_size):
+            chunks.append(chunk)
+            chunk = []
+            url_length = len(base_url)
+            doi_length -= 2
+        chunk.append(doi)
+        url_length += doi_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
 
 # authors_raw = [re.sub(', \d{4}-\d{4}-\d{4}-\d{3,4}X?', '', author_raw.strip()) for author_raw in instance['author'].split(';')]
 def load_metadata_from_dois_oc(dois, doi_dict=None):
-    doi_str = '__'.join(dois)
+    doi_str = '__'.join(urllib.parse.quote(doi, safe='/') for doi in dois)
 
     if doi_dict is None:
         doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
 
     try:
-        response = requests.get(f'https://opencitations.net/index/api/v1/metadata/{doi_str}', headers={ 'Accept': 'application/json' })
+        response = http_get(f'{OC_METADATA_URL}{doi_str}', headers={ 'Accept': 'application/json' })
         response.raise_for_status()
+        instances = response.json()
     except Exception as err:
         print('Erro ocorrido5: {0}'.format(err))
         traceback.print_exc()
-        return dict()
+        return doi_dict
 
-    for instance in response.json():
-        doi_dict[instance['doi']] = instance
+    # o metadata do opencitations não tem afiliações, fica separado do metadata do crossref/datacite
+    for instance in instances:
+        doi = instance['doi'].lower()
+        if doi not in doi_dict:
+            doi_dict[doi] = dict()
+        doi_dict[doi]['metadata_oc'] = instance
+
+    # o lote respondeu e não trouxe esses, não adianta pedi-los no próximo lote
+    for doi in dois:
+        if 'metadata_oc' not in doi_dict.get(doi, dict()):
+            record_failure('oc_metadata', doi, 'not_found')
     return doi_dict
 
+def load_metadata_from_dois_oc_batched(dois, doi_dict=None):
+    if doi_dict is None:
+        doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
+
+    pending_dois = [doi for doi in dict.fromkeys(dois)
+                    if needs_oc_metadata(doi, doi_dict.get(doi, dict())) and not is_negative_cached('oc_metadata', doi)]
+    for chunk in chunk_dois_for_url(pending_dois):
+        load_metadata_from_dois_oc(chunk, doi_dict)
+
+    # dois que o lote não retornou ou não decidiu, precisam da busca individual
+    return [doi for doi in dict.fromkeys(dois) if not has_metadata(doi_dict.get(doi, dict()))]
+
 def load_metadata_from_doi_crossref(doi, doi_dict=None):
     if doi_dict is None:
         doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
@@ -266,21 +165,26 @@ def load_metadata_from_doi_crossref(doi, doi_dict=None):
     if 'agency' not in doi_dict[doi] or doi_dict[doi]['agency'] != 'crossref':
         raise Exception(f'doi {doi} não é do crossref para baixar do crossref')
 
+    if is_negative_cached('crossref_metadata', doi):
+        return doi_dict
+
     try:
-        response = requests.get(f'https://api.crossref.org/works/{doi}', headers={ 'Accept': 'application/json' })
+        response = http_get(f'https://api.crossref.org/works/{doi}', headers={ 'Accept': 'application/json' })
         response.raise_for_status()
+        response_json = response.json()
     except Exception as err:
         # print('Erro ocorrido6: {0}'.format(err))
         # traceback.print_exc()
+        record_failure('crossref_metadata', doi, err)
         return doi_dict
 
-    response_json = response.json()
-    if response_json['status'] != 'ok':
-        print('Erro ocorrido7: {0}'.format(response['message']))
-        traceback.print_exc()
+    if response_json.get('status') != 'ok':
+        print('Erro ocorrido7: {0}'.format(response_json.get('message')))
+        record_failure('crossref_metadata', doi, 'bad_payload')
         return doi_dict
 
     doi_dict[doi]['metadata'] = response_json
+    clear_failure('crossref_metadata', doi)
     
     return doi_dict
 
@@ -294,21 +198,25 @@ def load_metadata_from_doi_datacite(doi, doi_dict=None):
     if 'agency' not in doi_dict[doi] or doi_dict[doi]['agency'] != 'datacite':
         raise Exception(f'doi {doi} não é do datacite para baixar do datacite')
 
+    if is_negative_cached('datacite_metadata', doi):
+        return doi_dict
+
     try:
-        response = requests.get(f'https://api.datacite.org/dois/{urllib.parse.quote_plus(doi)}', headers={ 'Accept': 'application/json' })
+        response = http_get(f'https://api.datacite.org/dois/{urllib.parse.quote_plus(doi)}', headers={ 'Accept': 'application/json' })
         response.raise_for_status()
+        response_json = response.json()
     except Exception as err:
         print('Erro ocorrido8: {0}'.format(err))
-        traceback.print_exc()
+        record_failure('datacite_metadata', doi, err)
         return doi_dict
 
-    response_json = response.json()
     if 'data' not in response_json:
         print('Erro ocorrido9: {0}'.format(json.dumps(response_json)))
-        traceback.print_exc()
+        record_failure('datacite_metadata', doi, 'bad_payload')
         return doi_dict
 
     doi_dict[doi]['metadata'] = response_json
+    clear_failure('datacite_metadata', doi)
     
     return doi_dict
 
@@ -322,25 +230,82 @@ def load_metadata_from_paper_id_semanticscholar(pid, doi_dict=None):
     if 'agency' not in doi_dict[pid] or doi_dict[pid]['agency'] != 'semanticscholar':
         raise Exception(f'doi {pid} não é do semanticscholar para baixar do semanticscholar')
 
+    if is_negative_cached('ss_metadata', pid):
+        return doi_dict
+
+    if get_identity_index().get_canonical(pid) != pid:
+        # o mesmo artigo já é conhecido por outra chave, os metadados vêm por ela
+        return doi_dict
+
     try:
-        response = requests.get(f'https://api.semanticscholar.org/v1/paper/{pid}', headers={ 'Accept': 'application/json' })
+        response = http_get(f'https://api.semanticscholar.org/v1/paper/{pid}', headers={ 'Accept': 'application/json' })
         response.raise_for_status()
+        response_json = response.json()
     except Exception as err:
         print('Erro ocorrido8: {0}'.format(err))
-        traceback.print_exc()
+        record_failure('ss_metadata', pid, err)
         return doi_dict
 
-    response_json = response.json()
     if 'paperId' not in response_json:
         print('Erro ocorrido9: {0}'.format(json.dumps(response_json)))
-        traceback.print_exc()
+        record_failure('ss_metadata', pid, 'bad_payload')
         return doi_dict
 
     doi_dict[pid]['metadata'] = response_json
+    clear_failure('ss_metadata', pid)
+    get_identity_index().link_paper_ss(response_json)
     
     return doi_dict
 
-def load_agency_from_doi(doi, doi_dict=None):
+# a agência de registro quase sempre depende só do prefixo do doi
+DOI_PREFIXES_JSON_PATH = os.path.join('data', 'doi_prefixes.json')
+SEED_PREFIX_AGENCIES = {
+    '10.1145': 'crossref',
+    '10.1109': 'crossref',
+    '10.5753': 'crossref',
+    '10.1007': 'crossref',
+    '10.1016': 'crossref',
+    '10.1002': 'crossref',
+    '10.3390': 'crossref',
+    '10.14569': 'crossref',
+    '10.1590': 'crossref',
+    '10.5281': 'datacite',
+    '10.6084': 'datacite',
+    '10.48550': 'datacite',
+}
+prefix_agencies = None
+prefix_agencies_lock = threading.Lock()
+
+def get_doi_prefix(doi):
+    if doi[:3] != '10.' or '/' not in doi:
+        return None
+    return doi.split('/', 1)[0]
+
+def get_prefix_agencies():
+    global prefix_agencies
+    with prefix_agencies_lock:
+        if prefix_agencies is None:
+            prefix_agencies = load_dict(DOI_PREFIXES_JSON_PATH)
+            for prefix, agency in SEED_PREFIX_AGENCIES.items():
+                prefix_agencies.setdefault(prefix, agency)
+    return prefix_agencies
+
+def learn_prefix_agency(doi, agency):
+    prefix = get_doi_prefix(doi)
+    if prefix is None:
+        return
+    table = get_prefix_agencies()
+    with prefix_agencies_lock:
+        if prefix not in table:
+            table[prefix] = agency
+        elif table[prefix] is not None and table[prefix] != agency:
+            # prefixo com agências diferentes, esses dois sempre consultam a rede
+            table[prefix] = None
+        else:
+            return
+        save_dict(table, DOI_PREFIXES_JSON_PATH)
+
+def load_agency_from_doi(doi, doi_dict=None, use_prefix=True):
     if doi_dict is None:
         doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
 
@@ -354,29 +319,365 @@ def load_agency_from_doi(doi, doi_dict=None):
         print(f'agencia_errada:{doi}')
         return doi_dict
 
+    if use_prefix and get_prefix_agencies().get(get_doi_prefix(doi)) is not None:
+        doi_dict[doi]['agency'] = get_prefix_agencies()[get_doi_prefix(doi)]
+        doi_dict[doi]['agency_source'] = 'prefix'
+        return doi_dict
+
+    if is_negative_cached('crossref_agency', doi):
+        return doi_dict
+
     try:
-        response = requests.get(f'https://api.crossref.org/works/{doi}/agency', headers={ 'Accept': 'application/json' })
+        response = http_get(f'https://api.crossref.org/works/{doi}/agency', headers={ 'Accept': 'application/json' })
         response.raise_for_status()
         response_json = response.json()
-    except (Exception, requests.exceptions.HTTPError) as err:
-        if err.response.status_code == 404:
-            response2 = requests.get(f'https://api.crossref.org/works/{doi}', headers={ 'Accept': 'application/json' })
-            if response2.status_code == 200:
-                doi_dict[doi]['agency'] = 'crossref'
-                return doi_dict
+    except Exception as err:
+        # timeouts e erros de conexão não têm response
+        if getattr(err, 'response', None) is not None and err.response.status_code == 404:
+            try:
+                response2 = http_get(f'https://api.crossref.org/works/{doi}', headers={ 'Accept': 'application/json' })
+            except requests.exceptions.RequestException as err2:
+                err = err2
+            else:
+                if response2.status_code == 200:
+                    doi_dict[doi]['agency'] = 'crossref'
+                    learn_prefix_agency(doi, 'crossref')
+                    clear_failure('crossref_agency', doi)
+                    return doi_dict
         # print('Erro ocorrido10: {0}'.format(err))
         # traceback.print_exc()
+        record_failure('crossref_agency', doi, err)
         return doi_dict
-    if response_json['status'] != 'ok':
-        print('Erro ocorrido11: {0}'.format(response['message']))
-        traceback.print_exc()
+    if response_json.get('status') != 'ok':
+        print('Erro ocorrido11: {0}'.format(response_json.get('message')))
+        record_failure('crossref_agency', doi, 'bad_payload')
         return doi_dict
 
     doi_dict[doi]['agency'] = response_json['message']['agency']['id']
+    learn_prefix_agency(doi, doi_dict[doi]['agency'])
+    clear_failure('crossref_agency', doi)
     
     return doi_dict
 
-def load_citators_from_publications(publications):
+METADATA_LOADERS = {
+    'crossref': load_metadata_from_doi_crossref,
+    'datacite': load_metadata_from_doi_datacite,
+    'semanticscholar': load_metadata_from_paper_id_semanticscholar,
+}
+
+# busca de metadados de cada agência, como aparece no cache de falhas
+METADATA_LOOKUPS = {
+    'crossref': 'crossref_metadata',
+    'datacite': 'datacite_metadata',
+    'semanticscholar': 'ss_metadata',
+}
+
+def should_verify_prefix_agency(doi, doi_entry):
+    # a agência veio do prefixo e respondeu que não conhece o doi; uma falha transitória
+    # ou uma busca pulada pelo cache de falhas não diz nada sobre a agência
+    if doi_entry.get('agency_source') != 'prefix' or has_metadata(doi_entry):
+        return False
+    return get_cached_failure(METADATA_LOOKUPS.get(doi_entry.get('agency')), doi) == 'not_found'
+
+def verify_prefix_agency(doi, doi_dict):
+    # confirma a agência pela rede; sem resposta, a do prefixo fica para a próxima tentativa
+    if not should_verify_prefix_agency(doi, doi_dict[doi]):
+        return False
+    previous_agency = doi_dict[doi].pop('agency')
+    doi_dict[doi].pop('agency_source', None)
+    load_agency_from_doi(doi, doi_dict, use_prefix=False)
+    if 'agency' not in doi_dict[doi]:
+        doi_dict[doi]['agency'] = previous_agency
+        doi_dict[doi]['agency_source'] = 'prefix'
+        return False
+    return doi_dict[doi]['agency'] != previous_agency
+
+def load_metadata_from_agency(doi, doi_dict):
+    agency = doi_dict[doi].get('agency')
+    if agency in METADATA_LOADERS:
+        METADATA_LOADERS[agency](doi, doi_dict)
+    elif agency is not None:
+        print(f'doi {doi} não é do conhecido, é do {agency}')
+    return doi_dict
+
+def resolve_doi_metadata(doi, doi_dict):
+    load_agency_from_doi(doi, doi_dict)
+    if 'agency' not in doi_dict[doi]:
+        return doi_dict
+    load_metadata_from_agency(doi, doi_dict)
+    if verify_prefix_agency(doi, doi_dict):
+        load_metadata_from_agency(doi, doi_dict)
+    return doi_dict
+
+async def crawl_resolve_doi(doi, doi_dict, semaphores):
+    # as threads trabalham numa cópia da entrada, o doi_dict compartilhado só é alterado no event loop
+    local_dict = {doi: dict(doi_dict.get(doi, dict()))}
+    if 'agency' not in local_dict[doi]:
+        await run_limited(semaphores, 'crossref', load_agency_from_doi, doi, local_dict)
+    agency = local_dict[doi].get('agency')
+    if agency in METADATA_LOADERS:
+        await run_limited(semaphores, agency, METADATA_LOADERS[agency], doi, local_dict)
+    elif agency is not None:
+        print(f'doi {doi} não é do conhecido, é do {agency}')
+    if should_verify_prefix_agency(doi, local_dict[doi]) \
+            and await run_limited(semaphores, 'crossref', verify_prefix_agency, doi, local_dict):
+        agency = local_dict[doi]['agency']
+        if agency in METADATA_LOADERS:
+            await run_limited(semaphores, agency, METADATA_LOADERS[agency], doi, local_dict)
+    doi_dict[doi] = local_dict[doi]
+
+def merge_citators(doi, citations, doi_dict, citations_oc, citations_dois_ss, citations_pids_ss):
+    # uma lista parcial de uma execução anterior é completada, não substituída
+    citations[doi] = list(set(citations.get(doi, []) + citations_oc + citations_dois_ss + citations_pids_ss))
+    for pid in citations_pids_ss:
+        if pid not in doi_dict:
+            doi_dict[pid] = {}
+        if 'agency' not in doi_dict[pid]:
+            doi_dict[pid]['agency'] = 'semanticscholar'
+
+async def crawl_publication_citators(doi, citations, doi_dict, semaphores, partial=False):
+    # (citantes, completa); None se nenhuma das fontes respondeu
+    if doi not in citations or partial:
+        citations_oc, (citations_dois_ss, citations_pids_ss) = await asyncio.gather(
+            run_limited(semaphores, 'opencitations', get_citing_dois_oc, doi),
+            run_limited(semaphores, 'semanticscholar', get_citing_dois_and_pids_ss, doi))
+        if is_negative_cached('oc_citations', doi) and is_negative_cached('ss_citations', doi) and not is_citation_list_complete(doi):
+            # nenhuma das fontes respondeu, a lista vazia não seria um resultado
+            return None
+        merge_citators(doi, citations, doi_dict, citations_oc, citations_dois_ss, citations_pids_ss)
+
+    citing_dois = get_identity_index().canonicalize(citations.get(doi))
+    citations[doi] = citing_dois
+    return citing_dois, is_citation_list_complete(doi)
+
+async def crawl_metadata_oc_chunk(chunk, doi_dict, semaphores):
+    local_dict = dict()
+    await run_limited(semaphores, 'opencitations', load_metadata_from_dois_oc, chunk, local_dict)
+    for doi, doi_entry in local_dict.items():
+        if doi not in doi_dict:
+            doi_dict[doi] = dict()
+        doi_dict[doi].update(doi_entry)
+
+def redirect_aliased_metadata(queue, dois):
+    # itens que hoje são alias de outra chave: a chave canônica entra no lugar deles
+    identities = get_identity_index()
+    for doi in dois:
+        canonical = identities.get_canonical(doi)
+        if canonical != doi and queue.get_state('metadata', doi) == 'pending':
+            queue.finish('metadata', doi)
+            queue.add('metadata', [canonical])
+
+def finish_metadata_item(queue, doi, doi_dict):
+    if is_metadata_resolved(doi_dict.get(doi, dict())):
+        queue.finish('metadata', doi)
+    else:
+        queue.fail('metadata', doi, 'metadata')
+
+# workers fixos por etapa, as requisições continuam limitadas pelos semáforos de cada serviço
+CITATION_WORKERS = CRAWL_CONCURRENCY['opencitations']
+RESOLVE_WORKERS = CRAWL_CONCURRENCY['crossref']
+ORCID_CHUNK_SIZE = 100
+# nas caixas das etapas, None encerra os workers e BATCH_DONE acorda o agrupador de lotes
+BATCH_DONE = object()
+
+async def drain_inbox(inbox, handle, stop):
+    # depois do stop o resto da caixa só é consumido: os itens ficam pendentes na fila de trabalho
+    while True:
+        item = await inbox.get()
+        if item is None:
+            inbox.put_nowait(None)
+            return
+        if not stop.is_set():
+            await handle(item)
+
+async def run_workers(count, inbox, handle, stop):
+    await asyncio.gather(*(drain_inbox(inbox, handle, stop) for _ in range(count)))
+
+async def crawl_citators(publications, citations, doi_dict, citations_json_path, doi_dict_path, save_every=50, orcid_dict=None):
+    semaphores = {service: asyncio.Semaphore(limit) for service, limit in CRAWL_CONCURRENCY.items()}
+    orcid_json_path = os.path.join('data', 'orcid.json')
+    if orcid_dict is None:
+        orcid_dict = load_dict(orcid_json_path)
+    identities = get_identity_index()
+
+    queue = WorkQueue()
+    queue.add('citations', dict.fromkeys(doi for doi in map(get_doi, publications) if doi is not None))
+
+    stop = asyncio.Event()
+    restore_stop_handler = install_stop_handler(stop)
+
+    def save_checkpoint():
+        # os dados antes da fila: um item só aparece como feito depois que o resultado está no disco
+        save_dict(citations, citations_json_path)
+        save_dict(doi_dict, doi_dict_path)
+        save_dict(orcid_dict, orcid_json_path)
+        identities.save()
+        save_negative_cache()
+        queue.checkpoint()
+
+    progress = { 'done': 0 }
+    def tick():
+        progress['done'] += 1
+        if progress['done'] % save_every == 0:
+            save_checkpoint()
+
+    # etapas encadeadas: cada citante novo segue para os metadados e cada metadado resolvido
+    # para os orcids, sem esperar a etapa anterior terminar; o que ficou pendente de uma
+    # execução anterior entra nas caixas desde o início
+    citation_inbox = asyncio.Queue()
+    metadata_inbox = asyncio.Queue()
+    resolve_inbox = asyncio.Queue()
+    orcid_inbox = asyncio.Queue()
+    for doi in queue.get_pending('citations'):
+        citation_inbox.put_nowait(doi)
+    citation_inbox.put_nowait(None)
+    for doi in queue.get_pending('metadata'):
+        metadata_inbox.put_nowait(doi)
+    for orcid in queue.get_pending('orcid'):
+        orcid_inbox.put_nowait(orcid)
+
+    def finish_metadata(doi):
+        # só os orcids de metadados resolvidos nesta execução entram na fila
+        finish_metadata_item(queue, doi, doi_dict)
+        if queue.get_state('metadata', doi) == 'done':
+            for orcid in dict.fromkeys(get_orcids_from_doi_metadata(doi_dict.get(doi, dict()))):
+                if orcid is not None and queue.add('orcid', [orcid]) > 0:
+                    orcid_inbox.put_nowait(orcid)
+
+    async def crawl_citation(doi):
+        partial = queue.get_error('citations', doi) == 'partial'
+        queue.start('citations', doi)
+        result = await crawl_publication_citators(doi, citations, doi_dict, semaphores, partial)
+        if result is None:
+            queue.fail('citations', doi, 'citations')
+        else:
+            citing_dois, complete = result
+            if complete:
+                queue.finish('citations', doi)
+            else:
+                # uma das fontes falhou por enquanto, a publicação é buscada de novo na próxima execução
+                queue.keep_partial('citations', doi)
+            for citing_doi in citing_dois:
+                if queue.add('metadata', [citing_doi]) > 0:
+                    metadata_inbox.put_nowait(citing_doi)
+        tick()
+
+    async def crawl_citations():
+        await run_workers(CITATION_WORKERS, citation_inbox, crawl_citation, stop)
+        metadata_inbox.put_nowait(None)
+
+    # lotes do opencitations em andamento
+    batches = set()
+
+    async def crawl_metadata_chunk(chunk):
+        for doi in chunk:
+            queue.start('metadata', doi)
+        await crawl_metadata_oc_chunk(chunk, doi_dict, semaphores)
+        for doi in chunk:
+            if has_metadata(doi_dict.get(doi, dict())):
+                finish_metadata(doi)
+            else:
+                # fica para a busca individual, pela agência
+                queue.set_state('metadata', doi, 'pending')
+                queue.add('agency', [doi])
+                resolve_inbox.put_nowait(doi)
+        tick()
+        # sai do conjunto antes de acordar o agrupador, o done callback só roda depois dele
+        batches.discard(asyncio.current_task())
+        metadata_inbox.put_nowait(BATCH_DONE)
+
+    async def batch_metadata():
+        # junta os dois em lotes do opencitations; um lote incompleto só sai quando a caixa
+        # está vazia e nenhum lote está em andamento, para não picar as requisições
+        batch_dois = []
+
+        def dispatch(chunks):
+            for chunk in chunks:
+                task = asyncio.create_task(crawl_metadata_chunk(chunk))
+                batches.add(task)
+                task.add_done_callback(batches.discard)
+
+        while True:
+            if metadata_inbox.empty() and len(batch_dois) > 0 and len(batches) == 0 and not stop.is_set():
+                dispatch([batch_dois])
+                batch_dois = []
+            doi = await metadata_inbox.get()
+            if doi is None:
+                break
+            if doi is BATCH_DONE or stop.is_set():
+                continue
+            if identities.get_canonical(doi) != doi:
+                # virou alias de outra chave, que entra no lugar dele
+                queue.finish('metadata', doi)
+                doi = identities.get_canonical(doi)
+                if queue.add('metadata', [doi]) == 0:
+                    continue
+            doi_entry = doi_dict.get(doi, dict())
+            if has_metadata(doi_entry):
+                # já veio de uma execução anterior ou de outra publicação
+                finish_metadata(doi)
+            elif needs_oc_metadata(doi, doi_entry) and not is_negative_cached('oc_metadata', doi):
+                batch_dois.append(doi)
+                chunks = chunk_dois_for_url(batch_dois)
+                if len(chunks) > 1:
+                    dispatch(chunks[:-1])
+                    batch_dois = chunks[-1]
+            else:
+                resolve_inbox.put_nowait(doi)
+
+        if len(batch_dois) > 0 and not stop.is_set():
+            dispatch(chunk_dois_for_url(batch_dois))
+        await asyncio.gather(*list(batches))
+        resolve_inbox.put_nowait(None)
+
+    async def resolve_metadata(doi):
+        queue.start('metadata', doi)
+        queue.add('agency', [doi])
+        queue.start('agency', doi)
+        await crawl_resolve_doi(doi, doi_dict, semaphores)
+        if 'agency' in doi_dict[doi]:
+            queue.finish('agency', doi)
+        else:
+            queue.fail('agency', doi, 'agency')
+        finish_metadata(doi)
+        tick()
+
+    async def resolve_all_metadata():
+        await run_workers(RESOLVE_WORKERS, resolve_inbox, resolve_metadata, stop)
+        orcid_inbox.put_nowait(None)
+
+    async def crawl_orcids():
+        # um worker só, o load_orcids já paraleliza dentro do lote
+        finished = False
+        while not finished:
+            chunk = [await orcid_inbox.get()]
+            while len(chunk) < ORCID_CHUNK_SIZE and not orcid_inbox.empty():
+                chunk.append(orcid_inbox.get_nowait())
+            if None in chunk:
+                chunk.remove(None)
+                finished = True
+            if stop.is_set() or len(chunk) == 0:
+                continue
+            for orcid in chunk:
+                queue.start('orcid', orcid)
+            local_dict = {orcid: dict(orcid_dict.get(orcid, dict())) for orcid in chunk}
+            await asyncio.to_thread(load_orcids, chunk, local_dict)
+            orcid_dict.update(local_dict)
+            for orcid in chunk:
+                if 'person' in orcid_dict[orcid] and 'employments' in orcid_dict[orcid]:
+                    queue.finish('orcid', orcid)
+                else:
+                    queue.fail('orcid', orcid, 'orcid')
+            tick()
+
+    try:
+        await asyncio.gather(crawl_citations(), batch_metadata(), resolve_all_metadata(), crawl_orcids())
+    finally:
+        save_checkpoint()
+        restore_stop_handler()
+    print(json.dumps(queue.get_counts()))
+
+def load_citators_from_publications(publications, concurrent=True):
 
     citators_json_path = 'data/citators.json'
     citators = load_dict(citators_json_path)
@@ -388,81 +689,90 @@ def load_citators_from_publications(publications):
     doi_dict_path = os.path.join('data', 'doi_metadata.json')
     doi_dict = load_dict(doi_dict_path)
 
-    for publication in publications:
-        doi = get_doi(publication)
-        if doi is None:
-            continue
-
-        if doi not in citations:
-            citations_oc = get_citing_dois_oc(doi)
-            citations_dois_ss, citations_pids_ss = get_citing_dois_and_pids_ss(doi)
-            citations[doi] = list(set(citations_oc + citations_dois_ss + citations_pids_ss))
-            for pid in citations_pids_ss:
-                if pid not in doi_dict:
-                    doi_dict[pid] = {}
-                if 'agency' not in doi_dict[pid]: 
-                    doi_dict[pid]['agency'] = 'semanticscholar'
+    if concurrent:
+        asyncio.run(crawl_citators(publications, citations, doi_dict, citations_json_path, doi_dict_path))
+        return
+
+    queue = WorkQueue()
+    queue.add('citations', dict.fromkeys(doi for doi in map(get_doi, publications) if doi is not None))
+
+    def resolve_pending_metadata(dois):
+        redirect_aliased_metadata(queue, dois)
+        dois = get_identity_index().canonicalize(dois)
+        new_dois = [doi for doi in dict.fromkeys(dois) if queue.get_state('metadata', doi) == 'pending']
+        if len(new_dois) == 0:
+            return
+        for new_doi in load_metadata_from_dois_oc_batched(new_dois, doi_dict):
+            resolve_doi_metadata(new_doi, doi_dict)
+            if 'agency' in doi_dict.get(new_doi, dict()):
+                queue.add('agency', [new_doi])
+                queue.finish('agency', new_doi)
+        for new_doi in new_dois:
+            finish_metadata_item(queue, new_doi, doi_dict)
+        # print('salvei')
+        save_dict(doi_dict, doi_dict_path)
+
+    # metadados pendentes de uma execução interrompida são resolvidos antes das publicações novas
+    try:
+        resolve_pending_metadata(queue.get_pending('metadata'))
+        save_negative_cache()
+        queue.checkpoint()
+        for doi in queue.get_pending('citations'):
+            if doi not in citations or queue.get_error('citations', doi) == 'partial':
+                citations_oc = get_citing_dois_oc(doi)
+                citations_dois_ss, citations_pids_ss = get_citing_dois_and_pids_ss(doi)
+                if is_negative_cached('oc_citations', doi) and is_negative_cached('ss_citations', doi) and not is_citation_list_complete(doi):
+                    queue.fail('citations', doi, 'citations')
+                    continue
+                merge_citators(doi, citations, doi_dict, citations_oc, citations_dois_ss, citations_pids_ss)
+                save_dict(citations, citations_json_path)
+
+            # citations_dois_ss, citations_pids_ss = get_citing_dois_and_pids_ss(doi)
+            # for pid in citations_pids_ss:
+            #     if pid not in doi_dict:
+            #         doi_dict[pid] = {}
+            #     if 'agency' not in doi_dict[pid]: 
+            #         doi_dict[pid]['agency'] = 'semanticscholar'
+            # citations[doi] = list(set(citations[doi] + citations_pids_ss))
+            # save_dict(citations, citations_json_path)
+            
+            citing_dois = get_identity_index().canonicalize(citations.get(doi))
+            citations[doi] = citing_dois
             save_dict(citations, citations_json_path)
-
-        # citations_dois_ss, citations_pids_ss = get_citing_dois_and_pids_ss(doi)
-        # for pid in citations_pids_ss:
-        #     if pid not in doi_dict:
-        #         doi_dict[pid] = {}
-        #     if 'agency' not in doi_dict[pid]: 
-        #         doi_dict[pid]['agency'] = 'semanticscholar'
-        # citations[doi] = list(set(citations[doi] + citations_pids_ss))
-        # save_dict(citations, citations_json_path)
-        
-        citing_dois = list(set(citation.lower() for citation in citations.get(doi)))
-        citations[doi] = citing_dois
+            if is_citation_list_complete(doi):
+                queue.finish('citations', doi)
+            else:
+                queue.keep_partial('citations', doi)
+            queue.add('metadata', citing_dois)
+            resolve_pending_metadata(citing_dois)
+            save_negative_cache()
+            queue.checkpoint()
+    except KeyboardInterrupt:
+        print('interrompido: gravando o checkpoint')
+    finally:
         save_dict(citations, citations_json_path)
-
-        new_dois = list(filter(lambda d: d not in doi_dict 
-                                or 'metadata' not in doi_dict[d], 
-                            citing_dois))
-        if len(new_dois) > 0:
-            for new_doi in new_dois:
-                load_agency_from_doi(new_doi, doi_dict)
-                if 'agency' not in doi_dict[new_doi]:
-                    continue
-
-                if doi_dict[new_doi]['agency'] == 'crossref':
-                    load_metadata_from_doi_crossref(new_doi, doi_dict)
-                elif doi_dict[new_doi]['agency'] == 'datacite':
-                    load_metadata_from_doi_datacite(new_doi, doi_dict)
-                elif doi_dict[new_doi]['agency'] == 'semanticscholar':
-                    load_metadata_from_paper_id_semanticscholar(new_doi, doi_dict)
-                else:
-                    raise Exception(f'doi {new_doi} não é do conhecido, é do {doi_dict[new_doi]["agency"]}')
-            # print('salvei')
-            save_dict(doi_dict, doi_dict_path)
-    
-def clean_affiliation(affiliation):
-    return affiliation.casefold().translate(REMOVE_ACCENTS_TRANSLATION).strip('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+        save_dict(doi_dict, doi_dict_path)
+        get_identity_index().save()
+        save_negative_cache()
+        queue.checkpoint()
     
 def load_affiliation_related_to_portuguese(affiliation, affiliation_dict=None):
-    affiliation = affiliation.casefold().translate(REMOVE_ACCENTS_TRANSLATION).strip('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+    affiliation = clean_affiliation(affiliation)
     if affiliation_dict is None:
         affiliation_dict = load_dict(os.path.join('data', 'affiliations.json'))
 
     if affiliation in affiliation_dict:
         return affiliation_dict[affiliation]
 
-    if affiliation.endswith(('brasil', 'brazil')) or any(x in affiliation for x in BRAZILIAN_STATES_CASEFOLDED + PORTUGUESE_COUNTRIES_CASEFOLDED):
-        affiliation_dict[affiliation] = True
-    elif affiliation.endswith(COUNTRIES_CASEFOLDED):
-        affiliation_dict[affiliation] = False
+    verdict = classify_affiliation_text(affiliation)
+    if verdict is not None:
+        affiliation_dict[affiliation] = verdict
+    elif review.BATCH_MODE:
+        # fica desconhecida até a revisão ser aplicada com review.py
+        review.enqueue_review('affiliation', affiliation)
+        return None
     else:
-        print('A afiliação com nome')
-        print(f'"{affiliation}"') 
-        print('é relacionada à lingua portuguesa?')
-        valid_yes_answers = ['s', 'sim', 'y', 'yes']
-        valid_no_answers = ['n', 'no', 'nao']
-        answer = ''
-        while answer not in valid_yes_answers + valid_no_answers:
-            answer = input("(s/n) ").casefold()
-
-        affiliation_dict[affiliation] = answer in valid_yes_answers
+        affiliation_dict[affiliation] = review.ask_related_to_portuguese('A afiliação com nome', affiliation)
     return affiliation_dict[affiliation]
 
 def load_orcid_related_to_portuguese(orcid, orcid_dict=None):
@@ -473,80 +783,20 @@ def load_orcid_related_to_portuguese(orcid, orcid_dict=None):
         load_orcid(orcid, orcid_dict, method='employment')
     if 'related_to_portuguese' in orcid_dict[orcid]:
         return orcid_dict[orcid]
-    
-    if 'person' in orcid_dict[orcid]:
-        person_dict = orcid_dict[orcid].get('person', dict())
-        if type(person_dict) is not dict:
-            person_dict = dict()
-
-        addresses_dict = person_dict.get('addresses', dict())
-        if type(addresses_dict) is not dict:
-            addresses_dict = dict()
-
-        addresses_list = addresses_dict.get('address', [])
-        if type(addresses_list) is not list:
-            addresses_list = list()
-
-        if len(addresses_list) > 0:
-            for address in addresses_list:
-                country_dict = address.get('country', dict())
-                if type(country_dict) is not dict:
-                    country_dict = dict()
-                country_code = country_dict.get('value', None)
-                if country_code in ('AO', 'BR', 'CV', 'GW', 'MZ', 'PT', 'ST'):
-                    orcid_dict[orcid]['related_to_portuguese'] = True
-                    return orcid_dict
-                    
-
-            orcid_dict[orcid]['related_to_portuguese'] = False
-            return orcid_dict
-            
-        employments_dict = orcid_dict[orcid].get('employments', dict())
-        if type(employments_dict) is not dict:
-            employments_dict = dict()
-
-        employments_list = employments_dict.get('employment-summary', [])
-        if type(employments_list) is not list:
-            employments_list = list()
-
-        if len(employments_list) > 0:
-            for employment in employments_list:
-                organization_dict = employment.get('organization', dict())
-                if type(organization_dict) is not dict:
-                    organization_dict = dict()
-                address_dict = organization_dict.get('address', dict())
-                if type(address_dict) is not dict:
-                    address_dict = dict()
-                country_code = address_dict.get('value', None)
-                if country_code in ('AO', 'BR', 'CV', 'GW', 'MZ', 'PT', 'ST'):
-                    orcid_dict[orcid]['related_to_portuguese'] = True
-                    return orcid_dict
-            orcid_dict[orcid]['related_to_portuguese'] = False
-            return orcid_dict
-        
-        biography_dict = person_dict.get('biography', dict())
-        if type(biography_dict) is not dict:
-            biography_dict = dict()
-        content_str = biography_dict.get('content', None)
-        if type(content_str) is str:
-            content_str = clean_affiliation(content_str)
-            if content_str.endswith(('brasil', 'brazil')) or any(x in content_str for x in BRAZILIAN_STATES_CASEFOLDED + ('brasil', 'brazil')):
-                orcid_dict[orcid]['related_to_portuguese'] = True
-                return orcid_dict
-            elif content_str.endswith(COUNTRIES_CASEFOLDED):
-                orcid_dict[orcid]['related_to_portuguese'] = False
-                return orcid_dict
-            else:
-                print('A biografia')
-                print(f'"{content_str}"') 
-                print('é relacionada à lingua portuguesa?')
-                valid_yes_answers = ['s', 'sim', 'y', 'yes']
-                valid_no_answers = ['n', 'no', 'nao']
-                answer = ''
-                while answer not in valid_yes_answers + valid_no_answers:
-                    answer = input("(s/n) ").casefold()
 
-                orcid_dict[orcid]['related_to_portuguese'] = answer in valid_yes_answers
+    verdict = classify_orcid_record(orcid_dict[orcid])
+    if verdict is not None:
+        orcid_dict[orcid]['related_to_portuguese'] = verdict
+        return orcid_dict
+
+    # só a biografia pode ficar sem veredito
+    content_str = get_orcid_biography(orcid_dict[orcid])
+    if content_str is None:
+        return orcid_dict
+    if review.BATCH_MODE:
+        review.enqueue_review('biography', content_str, orcid)
+    else:
+        orcid_dict[orcid]['related_to_portuguese'] = review.ask_related_to_portuguese('A biografia', content_str)
 
     return orcid_dict
 
@@ -581,11 +831,7 @@ def load_author_portuguese_related_dc(author_dict, orcid_dict=None, affiliation_
               author_dict['related_to_portuguese'] = True
     for name_identifier_dict in author_dict['nameIdentifiers']:
         if name_identifier_dict['scheme'] == 'ORCID':
-            orcid_url = name_identifier_dict['nameIdentifier']
-            if orcid_url[-4] == '-':
-                orcid_id = orcid_url[-18:] + 'X'
-            else:
-                orcid_id = orcid_url[-19:]
+            orcid_id = get_orcid_id_from_url(name_identifier_dict['nameIdentifier'])
             load_orcid(orcid_id, orcid_dict, method='person')
             load_orcid(orcid_id, orcid_dict, method='employments')
             load_orcid_related_to_portuguese(orcid_id, orcid_dict)
@@ -593,36 +839,60 @@ def load_author_portuguese_related_dc(author_dict, orcid_dict=None, affiliation_
                 author_dict['related_to_portuguese'] = author_dict.get('related_to_portuguese', False) or orcid_dict[orcid_id]['related_to_portuguese']
 
 
+def get_orcids_from_doi_metadata(doi_entry):
+    orcids = []
+    if 'metadata' in doi_entry:
+        metadata = doi_entry['metadata']
+        if doi_entry.get('agency') == 'crossref':
+            for author in metadata.get('message', dict()).get('author', []):
+                if 'ORCID' in author:
+                    orcids.append(author['ORCID'][-19:])
+        elif doi_entry.get('agency') == 'datacite':
+            for creator in metadata.get('data', dict()).get('creators', []):
+                for name_identifier_dict in creator.get('nameIdentifiers', []):
+                    if name_identifier_dict['scheme'] == 'ORCID':
+                        orcids.append(get_orcid_id_from_url(name_identifier_dict['nameIdentifier']))
+    elif 'metadata_oc' in doi_entry:
+        orcids.extend(ORCID_REGEX.findall(doi_entry['metadata_oc'].get('author') or ''))
+    return orcids
+
+def prefetch_orcids(dois, doi_dict, orcid_dict):
+    # busca em paralelo os orcids de um lote de dois antes da classificação
+    orcids = []
+    for doi in dois:
+        if doi in doi_dict and 'authors_related_to_portuguese' not in doi_dict[doi]:
+            orcids.extend(get_orcids_from_doi_metadata(doi_dict[doi]))
+    return load_orcids(orcids, orcid_dict)
+
 def load_doi_portuguese_affiliation(doi, doi_dict=None, orcid_dict=None, affiliation_dict=None):
     if doi_dict is None:
         doi_dict = load_dict(os.path.join('data', 'doi_metadata.json'))
 
     if doi not in doi_dict:
-        load_agency_from_doi(doi, doi_dict)
+        resolve_doi_metadata(doi, doi_dict)
         if 'agency' not in doi_dict[doi]:
             return doi_dict
-        if doi_dict[doi]['agency'] == 'crossref':
-            load_metadata_from_doi_crossref(doi, doi_dict)
-        elif doi_dict[doi]['agency'] == 'datacite':
-            load_metadata_from_doi_datacite(doi, doi_dict)
-        elif doi_dict[doi]['agency'] == 'semanticscholar':
-            load_metadata_from_paper_id_semanticscholar(doi, doi_dict)
-        else:
-            raise Exception(f'doi {doi} não é de lugar conhecido, é do {doi_dict[doi]["agency"]}')
-        
-    
+
     if 'agency' not in doi_dict[doi]:
         if doi[:3] != '10.':
             doi_dict[doi]['agency'] = 'semanticscholar'
             load_metadata_from_paper_id_semanticscholar(doi, doi_dict)
-        else:
+        elif 'metadata_oc' not in doi_dict[doi]:
             return doi_dict
 
-    unknown_authors = 0
-    brazilian_authors = 0
-    non_brazilian_authors = 0
-    
-    if doi_dict[doi]['agency'] == 'crossref':
+    if orcid_dict is None:
+        orcid_dict = load_dict(os.path.join('data', 'orcid.json'))
+    if affiliation_dict is None:
+        affiliation_dict = load_dict(os.path.join('data', 'affiliations.json'))
+
+    # aqui só se completa o que falta (orcids, afiliações sem veredito); o veredito vem da camada pura
+    if 'metadata' not in doi_dict[doi] and 'metadata_oc' in doi_dict[doi]:
+        # o opencitations só traz o orcid dos autores, autores sem orcid ficam desconhecidos
+        for orcid_id in ORCID_REGEX.findall(doi_dict[doi]['metadata_oc'].get('author') or ''):
+            load_orcid(orcid_id, orcid_dict, method='person')
+            load_orcid(orcid_id, orcid_dict, method='employments')
+            load_orcid_related_to_portuguese(orcid_id, orcid_dict)
+    elif doi_dict[doi]['agency'] == 'crossref':
         if 'metadata' not in doi_dict[doi]:
             print(f'{doi} não tem metadata nos metadados do crossref')
         elif 'message' not in doi_dict[doi]['metadata']:
@@ -632,12 +902,6 @@ def load_doi_portuguese_affiliation(doi, doi_dict=None, orcid_dict=None, affilia
         else:
             for author in doi_dict[doi]['metadata']['message']['author']:
                 load_author_portuguese_related_cf(author, orcid_dict, affiliation_dict)
-                if 'related_to_portuguese' not in author:
-                    unknown_authors += 1
-                elif author['related_to_portuguese']:
-                    brazilian_authors += 1
-                else:
-                    non_brazilian_authors += 1
     elif doi_dict[doi]['agency'] == 'datacite':
         if 'metadata' not in doi_dict[doi]:
             print(f'{doi} não tem metadata nos metadados do datacite')
@@ -648,79 +912,83 @@ def load_doi_portuguese_affiliation(doi, doi_dict=None, orcid_dict=None, affilia
         else:
             for creator in doi_dict[doi]['metadata']['data']['creators']:
                 load_author_portuguese_related_dc(creator, orcid_dict, affiliation_dict)
-                if 'related_to_portuguese' not in creator:
-                    unknown_authors += 1
-                elif author['related_to_portuguese']:
-                    brazilian_authors += 1
-                else:
-                    non_brazilian_authors += 1
 
     elif doi_dict[doi]['agency'] == 'semanticscholar':
         print(f'https://www.semanticscholar.org/paper/{doi}')
 
-    if doi[:8] == '10.5753/':
-        doi_dict[doi]['authors_related_to_portuguese'] = True
-        return doi_dict
-    
-    if brazilian_authors > 0:
-        doi_dict[doi]['authors_related_to_portuguese'] = True
-    elif unknown_authors == 0 and non_brazilian_authors > 0 and brazilian_authors == 0:
-        doi_dict[doi]['authors_related_to_portuguese'] = False
+    verdict = classify_doi(doi, doi_dict[doi], affiliation_dict, orcid_dict)
+    if verdict is not None:
+        doi_dict[doi]['authors_related_to_portuguese'] = verdict
 
     return doi_dict
 
 
-def add_meta(dataFrame, sbsi_dict, path):
-    
-
-
-    erro = 0
-
-    for df in dataFrame.iterrows():
-
-        if clean_affiliation(df[1]['titulo']) in ['apresentacao','organizacao']:
-            continue
-        if isinstance(df[1]['doi'], float) or len(df[1]['doi'].strip()) < 5:
-            try:
-                response = requests.get('https://dblp.org/search/publ/api?q={0}&format=json'.format(df[1]['titulo']))
-                response.raise_for_status()
-                excel_doi = response.json()['result']['hits']['hit'][0]['info']['ee']
-                df[1]['doi'] = excel_doi
-            except Exception as err:
-                print(f"Título com erro: \"{df[1]['titulo']}\"")
-                #print(df[1]['doi'])
-                #traceback.print_exc()
-                continue
+DOI_URL_PREFIXES = ('https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/', 'http://dx.doi.org/')
 
-        for item in sbsi_dict:
+def normalize_doi(doi):
+    doi = doi.strip().lower()
+    for prefix in DOI_URL_PREFIXES:
+        if doi.startswith(prefix):
+            return doi[len(prefix):]
+    return doi
 
-            # encodes = []
-            # encodes.append(item['info']['title'])
-            # encodes.append(item['info']['title'].encode('utf-8').decode('unicode_escape'))
-            # encodes.append(html.unescape(item['info']['title']))
+def build_ee_index(publications):
+    # ee normalizado -> primeira publicação com esse ee
+    ee_index = dict()
+    for publication in publications:
+        ees = publication['info'].get('ee', [])
+        for ee in ees if type(ees) is list else [ees]:
+            ee_index.setdefault(normalize_doi(ee), publication)
+    return ee_index
 
-            if item['info']['ee'] == df[1]['doi']:
-                item['language'] = df[1]['idioma']
-                break
+def search_dblp_ee(title):
+    try:
+        response = http_get('https://dblp.org/search/publ/api', params={ 'q': title, 'format': 'json' })
+        response.raise_for_status()
+        ee = response.json()['result']['hits']['hit'][0]['info']['ee']
+        return ee[0] if type(ee) is list else ee
+    except Exception as err:
+        print(f"Título com erro: \"{title}\" ({err})")
+        return None
 
-            # for titulo_encode in encodes:
-            #     if clean_affiliation(titulo_encode.rstrip(".")) == clean_affiliation(df[1]['titulo'].strip()):
-            #         """if (item['language'] == '__label__en' and df[1]['idioma'] == 'pt-br' ) or (item['language'] == '__label__pt' and df[1]['idioma'] == 'en'):
-            #             print (titulo_encode)
-            #             erro+=1"""
-            #         item['language'] = df[1]['idioma']
-            #         break
+def get_publication_ee(publication):
+    ee = publication['info'].get('ee')
+    return ee[0] if type(ee) is list else ee
+
+def add_meta(dataFrame, sbsi_dict, path, max_workers=4, use_network=True):
+    rows = dataFrame[~dataFrame['titulo'].map(clean_affiliation).isin(['apresentacao', 'organizacao'])]
+    ee_index = build_ee_index(sbsi_dict)
+
+    # linhas sem doi, ou com doi que não está na conferência, são casadas pelo título localmente
+    row_dois = dataFrame.loc[rows.index, 'doi'].map(lambda doi: normalize_doi(doi) if isinstance(doi, str) else '')
+    unmatched_rows = rows[~row_dois.isin(ee_index.keys())]
+    title_index = TitleIndex(sbsi_dict)
+    search_indexes = []
+    for index, title in zip(unmatched_rows.index, unmatched_rows['titulo']):
+        publication, score, candidates = title_index.query(title)
+        if publication is not None and get_publication_ee(publication) is not None:
+            dataFrame.at[index, 'doi'] = get_publication_ee(publication)
+        elif len(candidates) > 0:
+            print(f"Título ambíguo: \"{title}\" -> {[candidate['info']['title'] for candidate, candidate_score in candidates]}")
+        elif isinstance(dataFrame.at[index, 'doi'], float) or len(dataFrame.at[index, 'doi'].strip()) < 5:
+            search_indexes.append(index)
+
+    # só o que o índice local não resolveu vai para a busca do dblp, em paralelo
+    if use_network:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for index, ee in zip(search_indexes, executor.map(search_dblp_ee, dataFrame.loc[search_indexes, 'titulo'])):
+                dataFrame.at[index, 'doi'] = ee if ee is not None else float('nan')
+
+    row_dois = dataFrame.loc[rows.index, 'doi']
+    row_dois = row_dois[row_dois.map(lambda doi: isinstance(doi, str))].map(normalize_doi)
+    matched_dois = row_dois[row_dois.isin(ee_index.keys())]
+    for doi, language in zip(matched_dois, dataFrame.loc[matched_dois.index, 'idioma']):
+        ee_index[doi]['language'] = language
 
-                
-            
-    #print(erro)
     save_dict(sbsi_dict, path)
-            
-            
 
 if __name__ == '__main__':
     prepare_folders()
-    publications_list = load_conference('sbsi_new')
 
     doi_json_path = os.path.join('data', 'doi_metadata.json')
     doi_dict = load_dict(doi_json_path)
@@ -734,14 +1002,22 @@ if __name__ == '__main__':
     citations_json_path = 'data/citations.json'
     citations = load_dict(citations_json_path)
 
+    # o mesmo artigo pode estar nas listas pelo doi e pelo paperId, conta-se a chave canônica
+    identities = get_identity_index()
+
     publications_by_year = dict()
     info_by_year = list()
-    for publication in publications_list:
+    dict_sbsi_doi = dict()
+    # python main.py [conferência] [ano]; para várias conferências e anos use analysis.py
+    conference_alias = sys.argv[1] if len(sys.argv) > 1 else 'sbsi_new'
+    analysis_year = sys.argv[2] if len(sys.argv) > 2 else '2015'
+    for publication in iter_conference(conference_alias):
         publication_year = publication['info']['year']
         if publication_year not in publications_by_year:
             publications_by_year[publication_year] = []
         publication_year_list = publications_by_year.get(publication_year)
         publication_year_list.append(publication)
+        dict_sbsi_doi[publication["info"].get('doi',"").lower()] = publication['language']
 
 
     # for year in publications_by_year:
@@ -758,7 +1034,7 @@ if __name__ == '__main__':
     # df.plot()
     # plt.show()
 
-    publications_2015 = publications_by_year['2015']
+    publications_2015 = publications_by_year[analysis_year]
     # load_citators_from_publications(publications_2015)
     fig, ax = plt.subplots()
     pt_br_p = sum(publication['language'] == 'pt-br' for publication in publications_2015)
@@ -770,8 +1046,8 @@ if __name__ == '__main__':
     publications_2015_pt = [publication for publication in publications_2015 if publication['language'] == 'pt-br']
     publications_2015_en = [publication for publication in publications_2015 if publication['language'] == 'en']
     fig, ax = plt.subplots()
-    pt_br_c = sum(len(citations.get(publication['info'].get('doi', ''), [])) for publication in publications_2015_pt)
-    en_us_c = sum(len(citations.get(publication['info'].get('doi', ''), [])) for publication in publications_2015_en)
+    pt_br_c = sum(len(identities.canonicalize(citations.get(publication['info'].get('doi', ''), []))) for publication in publications_2015_pt)
+    en_us_c = sum(len(identities.canonicalize(citations.get(publication['info'].get('doi', ''), []))) for publication in publications_2015_en)
     ax.bar(['pt-BR', 'en-US'], [pt_br_c, en_us_c])
     ax.legend(title='Número de citações às publicações')
     plt.show()
@@ -783,13 +1059,6 @@ if __name__ == '__main__':
     ax.legend(title='Média de citações por publicação')
     plt.show()
 
-    viz_nosso_pt =                      {'color': {'r':   0, 'g': 255, 'b':   0, 'a': 1}}
-    viz_nosso_en =                      {'color': {'r':   0, 'g':   0, 'b': 255, 'a': 1}}
-    viz_externo_autoria_pt =            {'color': {'r': 255, 'g': 255, 'b':   0, 'a': 1}}
-    viz_externo_autoria_nao_pt =        {'color': {'r': 255, 'g':   0, 'b': 255, 'a': 1}}
-    viz_externo_autoria_desconhecida =  {'color': {'r': 255, 'g':   0, 'b':   0, 'a': 1}}
-
-
     citacoes_por_tipo_columns = ['Filiação lusófona \nà publicação em português',
                                  'Filiação lusófona \nà publicação em inglês',
                                  'Filiação não-lusófona \nà publicação em português',
@@ -801,47 +1070,44 @@ if __name__ == '__main__':
         'n_pt_en': 0
     }
 
-    G = nx.DiGraph()
-
-    dict_sbsi_doi = dict()
-    for publication in publications_list:
-        dict_sbsi_doi[publication["info"].get('doi',"").lower()] = publication['language']
+    # classifica de uma vez os citantes ainda sem veredito, gravando só no final
+    pending_citing_dois = [citing_doi for publication in publications_2015 for citing_doi in identities.canonicalize(citations.get(publication['info'].get('doi'), []))
+                           if citing_doi in doi_dict and 'authors_related_to_portuguese' not in doi_dict[citing_doi]]
+    prefetch_orcids(pending_citing_dois, doi_dict, orcid_dict)
+    for citing_doi in dict.fromkeys(pending_citing_dois):
+        load_doi_portuguese_affiliation(citing_doi, doi_dict, orcid_dict, affiliation_dict)
+    save_dict(orcid_dict, orcid_json_path)
+    save_dict(affiliation_dict, affiliation_json_path)
+    save_dict(doi_dict, doi_json_path)
+    identities.save()
+    save_negative_cache()
 
     for publication in publications_2015:
         doi = publication['info'].get('doi')
         if doi is None:
             continue
-        for citing_doi in citations.get(doi, []):
-            if citing_doi in doi_dict and 'authors_related_to_portuguese' not in doi_dict[citing_doi]:
-                load_doi_portuguese_affiliation(citing_doi, doi_dict, orcid_dict, affiliation_dict)
-                save_dict(orcid_dict, orcid_json_path)
-                save_dict(affiliation_dict, affiliation_json_path)
-            G.add_edge(citing_doi, doi.lower())
-            if citing_doi not in doi_dict or 'authors_related_to_portuguese' not in doi_dict[citing_doi] or doi_dict[citing_doi]['authors_related_to_portuguese'] is None:
-                G.nodes[citing_doi]['viz'] = viz_externo_autoria_desconhecida
-                if 'agency' in doi_dict[citing_doi] and doi_dict[citing_doi]['agency'] != 'semanticscholar':
+        for citing_doi in identities.canonicalize(citations.get(doi, [])):
+            verdict = doi_dict[citing_doi].get('authors_related_to_portuguese') if citing_doi in doi_dict else None
+            if verdict is None:
+                if citing_doi in doi_dict and doi_dict[citing_doi].get('agency', 'semanticscholar') != 'semanticscholar':
                     print(f'https://doi.org/{citing_doi}')
-            elif doi_dict[citing_doi]['authors_related_to_portuguese']:
-                G.nodes[citing_doi]['viz'] = viz_externo_autoria_pt
+            elif verdict:
                 if publication['language'] == 'pt-br':
                     citacoes_por_tipo['pt_pt'] += 1
                 else:
                     citacoes_por_tipo['pt_en'] += 1
             else:
-                G.nodes[citing_doi]['viz'] = viz_externo_autoria_nao_pt
                 if publication['language'] == 'pt-br':
                     citacoes_por_tipo['n_pt_pt'] += 1
                 else:
                     citacoes_por_tipo['n_pt_en'] += 1
-            #if(citing_doi in dict_sbsi_doi):
-            #    G.nodes[citing_doi]['viz'] = viz_nosso_pt if dict_sbsi_doi[citing_doi] == 'pt-br' else viz_nosso_en
 
-    for publication in publications_2015:
-        doi = publication['info'].get('doi')
-        if doi is None:
-            continue
-        G.add_node(doi.lower())
-        G.nodes[doi.lower()]['viz'] = viz_nosso_pt if publication['language'] == 'pt-br' else viz_nosso_en
+    # o grafo é mantido entre execuções e comparado com as citações e classificações atuais, só a diferença é gravada
+    graph_name = f'{conference_alias}_{analysis_year}'
+    graph_nodes, graph_edges = load_graph(graph_name)
+    graph_delta = update_citation_graph(publications_2015, citations, doi_dict, graph_nodes, graph_edges, identities=identities)
+    save_graph(graph_name, graph_nodes, graph_edges)
+    print(f'grafo {graph_name}: {graph_delta["nodes"]} nós e {graph_delta["edges"]} arestas alterados')
 
     fig, ax = plt.subplots()
     plt.xticks(
@@ -852,9 +1118,11 @@ if __name__ == '__main__':
     ax.legend(title='Quantidade de citações por tipo')
     plt.show()
         
-    # save_dict(doi_dict, doi_json_path)
+    write_gexf(graph_nodes, graph_edges, "data/citacoes_new.gexf")
 
-    nx.write_gexf(G, "data/citacoes_new.gexf")
+    array_graph = build_array_graph(graph_nodes, graph_edges)
+    for language_category, language_reach in language_citation_reach(array_graph).items():
+        print(f'{language_category}: {language_reach}')
 
     """prepare_folders()
 
@@ -870,6 +1138,7 @@ if __name__ == '__main__':
     doi_json_path = os.path.join('data', 'doi_metadata.json')
     doi_dict = load_dict(doi_json_path)
 
+    prefetch_orcids(list(doi_dict.keys()), doi_dict, orcid_dict)
     for doi in [key for key in doi_dict.keys()]:
         print(doi)
         load_doi_portuguese_affiliation(doi, doi_dict, orcid_dict, affiliation_dict)
@@ -891,7 +1160,7 @@ if __name__ == '__main__':
     #     if 'doi' not in publication['info']:
     #         print(publication)
     # authors = load_authors_from_publications(publications_list)
-    # publications_list[:] = map(classify_publication_language_fasttext, publications_list)
+    # classify_publications_language_fasttext(publications_list)
     # save_conference_locally('sbsi', publications_list)
     # [print("{0} {1}: {2}".format(p['language'], publications_list.index(p), p['info']['title'])) for p in publications_list if p['language'] not in ['__label__pt', '__label__en']]
 
@@ -2,7 +2,13 @@ import requests
 import orcid
 import os
 import json
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from storage import load_dict
+from http_service import get_rate_limiter
 
+secrets = dict()
 if os.path.isfile('secret.json'):
     with open('secret.json', 'r') as input_file:
         secrets = json.load(input_file)
@@ -10,31 +16,55 @@ if os.path.isfile('secret.json'):
     
 orcid_api = orcid.PublicAPI(secrets.get('orcid_client_id'), secrets.get('orcid_client_secret'), sandbox=False)
 orcid_search_token = None
-def load_dict(file_json_path):
-    if os.path.isfile(file_json_path):
-        with open(file_json_path, 'r') as input_file:
-            return json.load(input_file)
-    else:
-        return dict()
-
-def save_dict(json_dict, file_json_path):
-    json_str = json.dumps(json_dict, indent=4)
-    with open(file_json_path, 'w') as output_file:
-        output_file.write(json_str)
+orcid_search_token_lock = threading.Lock()
+ORCID_HOST = 'pub.orcid.org'
+ORCID_MAX_WORKERS = 8
 
-def load_orcid(orcid, orcid_dict=None, force=False, method='person'):
+def get_orcid_search_token():
     global orcid_search_token
+    if orcid_search_token is None:
+        with orcid_search_token_lock:
+            if orcid_search_token is None:
+                orcid_search_token = orcid_api.get_search_token_from_orcid()
+    return orcid_search_token
+
+def read_orcid_record(orcid, method):
+    token = get_orcid_search_token()
+    get_rate_limiter(ORCID_HOST).wait()
+    return orcid_api.read_record_public(orcid, method, token)
+
+def load_orcids(orcids, orcid_dict=None, force=False, methods=('person', 'employments'), max_workers=ORCID_MAX_WORKERS):
+    if orcid_dict is None:
+        orcid_dict = load_dict(os.path.join('data', 'orcid.json'))
+
+    # cada par (orcid, método) é buscado uma vez só, mesmo que o orcid apareça em vários artigos
+    jobs = [(orcid, method) for orcid in dict.fromkeys(orcids) for method in methods
+            if force or method not in orcid_dict.get(orcid, dict())]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(read_orcid_record, orcid, method): (orcid, method) for orcid, method in jobs}
+        for future in as_completed(futures):
+            orcid, method = futures[future]
+            try:
+                record = future.result()
+            except Exception as err:
+                print('Erro ocorrido orcid {0}: {1}'.format(orcid, err))
+                traceback.print_exc()
+                continue
+            if orcid not in orcid_dict:
+                orcid_dict[orcid] = {}
+            orcid_dict[orcid][method] = record
+
+    return orcid_dict
+
+def load_orcid(orcid, orcid_dict=None, force=False, method='person'):
     if orcid_dict is None:
         orcid_dict = load_dict(os.path.join('data', 'orcid.json'))
     if orcid not in orcid_dict:
         orcid_dict[orcid] = {}
     if method not in orcid_dict[orcid] or force:
-        if orcid_search_token is None:
-            orcid_search_token = orcid_api.get_search_token_from_orcid()
-        orcid_dict[orcid][method] = orcid_api.read_record_public(orcid, method, orcid_search_token)
+        orcid_dict[orcid][method] = read_orcid_record(orcid, method)
 
     return orcid_dict
 
 if __name__ == '__main__':
-    orcid_search_token = orcid_api.get_search_token_from_orcid()
-    print(json.dumps(orcid_api.read_record_public(input('orcid: '), input('metodo: '), orcid_search_token), indent=2))
\ No newline at end of file
+    print(json.dumps(read_orcid_record(input('orcid: '), input('metodo: ')), indent=2))
\ No newline at end of file
@@ -0,0 +1,91 @@
+import os
+import sys
+import hashlib
+from storage import load_dict, save_dict
+
+# com ANRESOC_BATCH=1 nada pergunta no terminal, os casos sem veredito vão para a fila de revisão
+BATCH_MODE = os.environ.get('ANRESOC_BATCH', '') not in ('', '0')
+REVIEW_QUEUE_JSON_PATH = os.path.join('data', 'review_queue.json')
+VALID_YES_ANSWERS = ['s', 'sim', 'y', 'yes']
+VALID_NO_ANSWERS = ['n', 'no', 'nao']
+
+review_queue = None
+
+def get_review_queue():
+    global review_queue
+    if review_queue is None:
+        review_queue = load_dict(REVIEW_QUEUE_JSON_PATH)
+    return review_queue
+
+def get_review_id(kind, text):
+    return hashlib.sha1(f'{kind}:{text}'.encode('utf-8')).hexdigest()[:16]
+
+def enqueue_review(kind, text, orcid=None):
+    queue = get_review_queue()
+    review_id = get_review_id(kind, text if orcid is None else orcid)
+    if review_id not in queue:
+        queue[review_id] = {
+            'kind': kind,
+            'text': text,
+            'orcid': orcid,
+            'answer': None
+        }
+        save_dict(queue, REVIEW_QUEUE_JSON_PATH)
+    return review_id
+
+def ask_related_to_portuguese(description, text):
+    print(description)
+    print(f'"{text}"')
+    print('é relacionada à lingua portuguesa?')
+    answer = ''
+    while answer not in VALID_YES_ANSWERS + VALID_NO_ANSWERS:
+        answer = input("(s/n) ").casefold()
+    return answer in VALID_YES_ANSWERS
+
+def review_pending():
+    # responde toda a fila numa sentada só
+    queue = get_review_queue()
+    pending_ids = [review_id for review_id, review in queue.items() if review['answer'] is None]
+    for index, review_id in enumerate(pending_ids, start=1):
+        review = queue[review_id]
+        description = 'A afiliação com nome' if review['kind'] == 'affiliation' else 'A biografia'
+        print(f'[{index}/{len(pending_ids)}] {review_id}')
+        queue[review_id]['answer'] = ask_related_to_portuguese(description, review['text'])
+        save_dict(queue, REVIEW_QUEUE_JSON_PATH)
+
+def apply_reviews(affiliation_dict=None, orcid_dict=None):
+    affiliation_json_path = os.path.join('data', 'affiliations.json')
+    orcid_json_path = os.path.join('data', 'orcid.json')
+    if affiliation_dict is None:
+        affiliation_dict = load_dict(affiliation_json_path)
+    if orcid_dict is None:
+        orcid_dict = load_dict(orcid_json_path)
+
+    queue = get_review_queue()
+    applied_ids = []
+    for review_id, review in queue.items():
+        if review['answer'] is None:
+            continue
+        if review['kind'] == 'affiliation':
+            affiliation_dict[review['text']] = review['answer']
+        elif review['kind'] == 'biography' and review['orcid'] in orcid_dict:
+            orcid_dict[review['orcid']]['related_to_portuguese'] = review['answer']
+        else:
+            continue
+        applied_ids.append(review_id)
+
+    for review_id in applied_ids:
+        del queue[review_id]
+    save_dict(affiliation_dict, affiliation_json_path)
+    save_dict(orcid_dict, orcid_json_path)
+    save_dict(queue, REVIEW_QUEUE_JSON_PATH)
+    return len(applied_ids)
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'review'
+    if command == 'review':
+        review_pending()
+    elif command == 'apply':
+        print(f'{apply_reviews()} respostas aplicadas')
+    else:
+        print('uso: python review.py [review|apply]')
@@ -0,0 +1,481 @@
+import os
+import json
+import tempfile
+import contextlib
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+# o arquivo json é o snapshot, as alterações entre compactações vão para um log jsonl ao lado
+LOG_SUFFIX = '.log'
+COMPACT_MIN_LOG_SIZE = 1024 * 1024
+COMPACT_RATIO = 1.0
+
+
+class PersistentDict(dict):
+    # como no SQLiteDict, o save só compara as chaves acessadas desde o último save: um valor
+    # lido pode ter sido alterado no lugar, um que ninguém leu não mudou. items() e values()
+    # entregam todos os valores, aí o próximo save compara tudo
+    def __init__(self, file_json_path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file_json_path = file_json_path
+        self.fingerprints = dict()
+        self.touched = set()
+        self.all_touched = True
+
+    def __getitem__(self, key):
+        self.touched.add(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self.touched.add(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.touched.add(key)
+        super().__delitem__(key)
+
+    def get(self, key, default=None):
+        self.touched.add(key)
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.touched.add(key)
+        return super().setdefault(key, default)
+
+    def pop(self, key, *args):
+        self.touched.add(key)
+        return super().pop(key, *args)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        self.touched.update(other)
+        super().update(other)
+
+    def popitem(self):
+        self.all_touched = True
+        return super().popitem()
+
+    def clear(self):
+        self.all_touched = True
+        super().clear()
+
+    def items(self):
+        self.all_touched = True
+        return super().items()
+
+    def values(self):
+        self.all_touched = True
+        return super().values()
+
+    def copy(self):
+        self.all_touched = True
+        return super().copy()
+
+    def take_touched(self):
+        # as chaves a comparar no save; o que for acessado durante o save fica para o próximo
+        touched, self.touched = self.touched, set()
+        all_touched, self.all_touched = self.all_touched, False
+        return set(self.fingerprints).union(dict.keys(self)) if all_touched else touched
+
+    def fingerprint(self, key):
+        return hash(json.dumps(dict.__getitem__(self, key)))
+
+    def mark_persisted(self):
+        self.take_touched()
+        self.fingerprints = {key: self.fingerprint(key) for key in dict.keys(self)}
+
+
+def get_log_path(file_json_path):
+    return file_json_path + LOG_SUFFIX
+
+@contextlib.contextmanager
+def atomic_writer(file_path):
+    # escreve num arquivo temporário ao lado e só troca pelo destino no final
+    directory = os.path.dirname(file_path) or '.'
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'w') as output_file:
+            yield output_file
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_atomic(data_str, file_path):
+    with atomic_writer(file_path) as output_file:
+        output_file.write(data_str)
+
+def replay_log(json_dict, log_path):
+    valid_size = 0
+    with open(log_path, 'rb') as input_file:
+        for line in input_file:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('linha incompleta')
+                entry = json.loads(line)
+            except ValueError:
+                # última linha cortada por um crash no meio da escrita
+                break
+            if entry.get('d'):
+                json_dict.pop(entry['k'], None)
+            else:
+                json_dict[entry['k']] = entry['v']
+            valid_size += len(line)
+    if valid_size < os.path.getsize(log_path):
+        os.truncate(log_path, valid_size)
+
+def load_json_dict(file_json_path):
+    json_dict = PersistentDict(file_json_path)
+    if os.path.isfile(file_json_path):
+        with open(file_json_path, 'r') as input_file:
+            json_dict.update(json.load(input_file))
+    log_path = get_log_path(file_json_path)
+    if os.path.isfile(log_path):
+        replay_log(json_dict, log_path)
+    json_dict.mark_persisted()
+    return json_dict
+
+def compact_dict(json_dict, file_json_path=None):
+    file_json_path = file_json_path or json_dict.file_json_path
+    write_atomic(json.dumps(json_dict, indent=4), file_json_path)
+    log_path = get_log_path(file_json_path)
+    if os.path.isfile(log_path):
+        os.remove(log_path)
+    if isinstance(json_dict, PersistentDict):
+        json_dict.mark_persisted()
+
+def should_compact(file_json_path):
+    log_path = get_log_path(file_json_path)
+    if not os.path.isfile(log_path):
+        return False
+    log_size = os.path.getsize(log_path)
+    snapshot_size = os.path.getsize(file_json_path) if os.path.isfile(file_json_path) else 0
+    return log_size > COMPACT_MIN_LOG_SIZE and log_size > snapshot_size * COMPACT_RATIO
+
+def save_json_dict(json_dict, file_json_path):
+    if not isinstance(json_dict, PersistentDict) or json_dict.file_json_path != file_json_path or not os.path.isfile(file_json_path):
+        compact_dict(json_dict, file_json_path)
+        return
+
+    # só as chaves que mudaram desde o último save vão para o log, e só as acessadas são comparadas
+    lines = []
+    fingerprints = dict()
+    touched = json_dict.take_touched()
+    for key in touched:
+        if dict.__contains__(json_dict, key):
+            fingerprint = json_dict.fingerprint(key)
+            if json_dict.fingerprints.get(key) != fingerprint:
+                lines.append(json.dumps({ 'k': key, 'v': dict.__getitem__(json_dict, key) }))
+                fingerprints[key] = fingerprint
+        elif key in json_dict.fingerprints:
+            lines.append(json.dumps({ 'k': key, 'd': True }))
+            fingerprints[key] = None
+
+    if len(lines) > 0:
+        try:
+            with open(get_log_path(file_json_path), 'a') as output_file:
+                output_file.write('\n'.join(lines) + '\n')
+                output_file.flush()
+                os.fsync(output_file.fileno())
+        except BaseException:
+            # nada foi gravado com certeza, o próximo save compara essas chaves de novo
+            json_dict.touched.update(touched)
+            raise
+    for key, fingerprint in fingerprints.items():
+        if fingerprint is None:
+            del json_dict.fingerprints[key]
+        else:
+            json_dict.fingerprints[key] = fingerprint
+
+    if should_compact(file_json_path):
+        compact_dict(json_dict, file_json_path)
+
+
+# backend sqlite: os caches de doi, citações, orcid e afiliações ficam num único banco indexado
+STORAGE_BACKEND = os.environ.get('ANRESOC_STORAGE', 'json')
+SQLITE_FILE_NAME = 'anresoc.sqlite'
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dois (key TEXT PRIMARY KEY, data TEXT NOT NULL, agency TEXT, authors_related_to_portuguese INTEGER);
+CREATE INDEX IF NOT EXISTS dois_agency ON dois (agency);
+CREATE INDEX IF NOT EXISTS dois_authors_related_to_portuguese ON dois (authors_related_to_portuguese);
+CREATE TABLE IF NOT EXISTS citations (key TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS citation_edges (cited TEXT NOT NULL, citing TEXT NOT NULL, PRIMARY KEY (cited, citing));
+CREATE INDEX IF NOT EXISTS citation_edges_citing ON citation_edges (citing);
+CREATE TABLE IF NOT EXISTS orcids (key TEXT PRIMARY KEY, data TEXT NOT NULL, related_to_portuguese INTEGER);
+CREATE INDEX IF NOT EXISTS orcids_related_to_portuguese ON orcids (related_to_portuguese);
+CREATE TABLE IF NOT EXISTS affiliations (key TEXT PRIMARY KEY, data TEXT NOT NULL, related_to_portuguese INTEGER);
+CREATE INDEX IF NOT EXISTS affiliations_related_to_portuguese ON affiliations (related_to_portuguese);
+'''
+
+def get_verdict(value, key):
+    if type(value) is not dict:
+        return None
+    verdict = value.get(key)
+    return None if verdict is None else int(bool(verdict))
+
+# colunas indexadas de cada tabela, extraídas do valor json
+SQLITE_TABLE_COLUMNS = {
+    'dois': {
+        'agency': lambda value: value.get('agency') if type(value) is dict else None,
+        'authors_related_to_portuguese': lambda value: get_verdict(value, 'authors_related_to_portuguese'),
+    },
+    'citations': {},
+    'orcids': {
+        'related_to_portuguese': lambda value: get_verdict(value, 'related_to_portuguese'),
+    },
+    'affiliations': {
+        'related_to_portuguese': lambda value: None if value is None else int(bool(value)),
+    },
+}
+SQLITE_TABLE_FILES = {
+    'doi_metadata.json': 'dois',
+    'citations.json': 'citations',
+    'orcid.json': 'orcids',
+    'affiliations.json': 'affiliations',
+}
+
+
+class SQLiteStore:
+    def __init__(self, sqlite_path):
+        self.sqlite_path = sqlite_path
+        self.connection = sqlite3.connect(sqlite_path, check_same_thread=False)
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.lock = threading.RLock()
+        self.tables = dict()
+
+    def table(self, table_name):
+        if table_name not in self.tables:
+            self.tables[table_name] = SQLiteDict(self, table_name)
+        return self.tables[table_name]
+
+    def execute(self, query, parameters=()):
+        with self.lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def flush(self):
+        for table in self.tables.values():
+            table.flush()
+
+    def get_citing_dois_with_unknown_authorship(self):
+        self.flush()
+        return [row[0] for row in self.execute('''
+            SELECT DISTINCT citation_edges.citing FROM citation_edges
+            LEFT JOIN dois ON dois.key = citation_edges.citing
+            WHERE dois.authors_related_to_portuguese IS NULL''')]
+
+    def get_dois_by_agency(self, agency):
+        self.flush()
+        return [row[0] for row in self.execute('SELECT key FROM dois WHERE agency = ?', (agency,))]
+
+    def get_citing_dois(self, cited_doi):
+        self.flush()
+        return [row[0] for row in self.execute('SELECT citing FROM citation_edges WHERE cited = ?', (cited_doi,))]
+
+    def get_cited_dois(self, citing_doi):
+        self.flush()
+        return [row[0] for row in self.execute('SELECT cited FROM citation_edges WHERE citing = ?', (citing_doi,))]
+
+
+class SQLiteDict(MutableMapping):
+    # só as chaves acessadas ficam em memória; os valores podem ser alterados
+    # no lugar, o flush compara o fingerprint e grava só o que mudou
+    def __init__(self, store, table_name):
+        self.store = store
+        self.table_name = table_name
+        self.columns = SQLITE_TABLE_COLUMNS[table_name]
+        self.cache = dict()
+        self.fingerprints = dict()
+
+    def __getitem__(self, key):
+        if key in self.cache:
+            return self.cache[key]
+        rows = self.store.execute(f'SELECT data FROM {self.table_name} WHERE key = ?', (key,))
+        if len(rows) == 0:
+            raise KeyError(key)
+        value = json.loads(rows[0][0])
+        self.cache[key] = value
+        self.fingerprints[key] = hash(rows[0][0])
+        return value
+
+    def __setitem__(self, key, value):
+        self.cache[key] = value
+        self.fingerprints[key] = None
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.cache.pop(key, None)
+        self.fingerprints.pop(key, None)
+        with self.store.lock, self.store.connection:
+            self.store.connection.execute(f'DELETE FROM {self.table_name} WHERE key = ?', (key,))
+            if self.table_name == 'citations':
+                self.store.connection.execute('DELETE FROM citation_edges WHERE cited = ?', (key,))
+
+    def __contains__(self, key):
+        if key in self.cache:
+            return True
+        return len(self.store.execute(f'SELECT 1 FROM {self.table_name} WHERE key = ?', (key,))) > 0
+
+    def __iter__(self):
+        self.flush()
+        keys = [row[0] for row in self.store.execute(f'SELECT key FROM {self.table_name}')]
+        return iter(keys)
+
+    def __len__(self):
+        self.flush()
+        return self.store.execute(f'SELECT COUNT(*) FROM {self.table_name}')[0][0]
+
+    def flush(self):
+        column_names = ['key', 'data'] + list(self.columns)
+        query = 'INSERT OR REPLACE INTO {0} ({1}) VALUES ({2})'.format(self.table_name, ', '.join(column_names), ', '.join('?' * len(column_names)))
+        with self.store.lock, self.store.connection:
+            for key, value in self.cache.items():
+                data = json.dumps(value)
+                fingerprint = hash(data)
+                if self.fingerprints.get(key) == fingerprint:
+                    continue
+                self.store.connection.execute(query, [key, data] + [extract(value) for extract in self.columns.values()])
+                if self.table_name == 'citations':
+                    self.store.connection.execute('DELETE FROM citation_edges WHERE cited = ?', (key,))
+                    self.store.connection.executemany('INSERT OR IGNORE INTO citation_edges (cited, citing) VALUES (?, ?)', [(key, citing) for citing in value])
+                self.fingerprints[key] = fingerprint
+
+    def evict(self):
+        # descarta da memória o que já está gravado
+        self.flush()
+        self.cache.clear()
+        self.fingerprints.clear()
+
+
+sqlite_stores = dict()
+
+def get_sqlite_store(directory='data'):
+    sqlite_path = os.path.join(directory, SQLITE_FILE_NAME)
+    if sqlite_path not in sqlite_stores:
+        sqlite_stores[sqlite_path] = SQLiteStore(sqlite_path)
+    return sqlite_stores[sqlite_path]
+
+def load_sqlite_dict(file_json_path):
+    store = get_sqlite_store(os.path.dirname(file_json_path) or '.')
+    table_name = SQLITE_TABLE_FILES[os.path.basename(file_json_path)]
+    sqlite_dict = store.table(table_name)
+    # na primeira vez migra o json existente para o banco
+    if os.path.isfile(file_json_path) and len(store.execute(f'SELECT 1 FROM {table_name} LIMIT 1')) == 0:
+        sqlite_dict.update(load_json_dict(file_json_path))
+        sqlite_dict.evict()
+    return sqlite_dict
+
+def load_dict(file_json_path):
+    if STORAGE_BACKEND == 'sqlite' and os.path.basename(file_json_path) in SQLITE_TABLE_FILES:
+        return load_sqlite_dict(file_json_path)
+    return load_json_dict(file_json_path)
+
+def save_dict(json_dict, file_json_path):
+    if isinstance(json_dict, SQLiteDict):
+        json_dict.flush()
+        return
+    save_json_dict(json_dict, file_json_path)
+
+
+# leitura em streaming: os elementos de um array ou os pares de um objeto json
+# de nível superior são devolvidos um a um, sem carregar o documento inteiro
+STREAM_CHUNK_SIZE = 1 << 16
+JSON_WHITESPACE = ' \t\n\r'
+json_decoder = json.JSONDecoder()
+
+
+class JSONStream:
+    def __init__(self, input_file, chunk_size=STREAM_CHUNK_SIZE):
+        self.input_file = input_file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def read_more(self):
+        if self.position > self.chunk_size:
+            self.buffer = self.buffer[self.position:]
+            self.position = 0
+        chunk = self.input_file.read(self.chunk_size)
+        if chunk == '':
+            self.eof = True
+        self.buffer += chunk
+
+    def peek(self):
+        # próximo caractere que não é espaço, None no fim do arquivo
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in JSON_WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.eof:
+                return None
+            self.read_more()
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError(f'json inválido: esperado {chars!r}, encontrado {char!r}')
+        self.position += 1
+        return char
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = json_decoder.raw_decode(self.buffer, self.position)
+                # número no fim do buffer pode estar cortado, só aceita com algo depois
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read_more()
+
+def iter_json_array(file_json_path, chunk_size=STREAM_CHUNK_SIZE):
+    with open(file_json_path, 'r') as input_file:
+        stream = JSONStream(input_file, chunk_size)
+        stream.expect('[')
+        if stream.peek() == ']':
+            return
+        while True:
+            yield stream.decode()
+            if stream.expect(',]') == ']':
+                return
+
+def iter_json_object(file_json_path, chunk_size=STREAM_CHUNK_SIZE):
+    with open(file_json_path, 'r') as input_file:
+        stream = JSONStream(input_file, chunk_size)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.decode()
+            stream.expect(':')
+            yield key, stream.decode()
+            if stream.expect(',}') == '}':
+                return
+
+def iter_jsonl(file_jsonl_path):
+    with open(file_jsonl_path, 'r') as input_file:
+        for line in input_file:
+            if line.strip() != '':
+                yield json.loads(line)
+
+def iter_dict_items(file_json_path):
+    # com log pendente ou backend sqlite o snapshot não basta, usa o load_dict normal
+    if STORAGE_BACKEND == 'sqlite' and os.path.basename(file_json_path) in SQLITE_TABLE_FILES:
+        yield from load_dict(file_json_path).items()
+    elif os.path.isfile(get_log_path(file_json_path)):
+        yield from load_dict(file_json_path).items()
+    elif os.path.isfile(file_json_path):
+        yield from iter_json_object(file_json_path)
+
+def write_jsonl(values, file_jsonl_path):
+    write_atomic(''.join(json.dumps(value) + '\n' for value in values), file_jsonl_path)
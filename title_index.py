@@ -0,0 +1,61 @@
+import re
+import html
+import unicodedata
+
+# índice invertido de tokens dos títulos para casar títulos da planilha com publicações
+# do dblp sem rede: os tokens mais raros do título buscado geram os candidatos, que são
+# reordenados pelo jaccard dos conjuntos de tokens
+TOKEN_REGEX = re.compile(r'\w+')
+MAX_QUERY_TOKENS = 4
+MIN_SCORE = 0.8
+AMBIGUITY_MARGIN = 0.05
+
+def normalize_title(title):
+    title = unicodedata.normalize('NFKD', html.unescape(title).casefold())
+    title = ''.join(char for char in title if not unicodedata.combining(char))
+    return TOKEN_REGEX.findall(title)
+
+
+class TitleIndex:
+    def __init__(self, publications):
+        self.publications = []
+        self.token_sets = []
+        self.postings = dict()
+        for publication in publications:
+            self.add(publication)
+
+    def add(self, publication):
+        publication_id = len(self.publications)
+        token_set = frozenset(normalize_title(publication['info']['title']))
+        self.publications.append(publication)
+        self.token_sets.append(token_set)
+        for token in token_set:
+            self.postings.setdefault(token, []).append(publication_id)
+
+    def get_candidates(self, token_set):
+        known_tokens = sorted((token for token in token_set if token in self.postings), key=lambda token: len(self.postings[token]))
+        candidates = set()
+        for token in known_tokens[:MAX_QUERY_TOKENS]:
+            candidates.update(self.postings[token])
+        return candidates
+
+    def query(self, title, min_score=MIN_SCORE, ambiguity_margin=AMBIGUITY_MARGIN):
+        # retorna (publicação ou None, score, candidatos ambíguos)
+        token_set = frozenset(normalize_title(title))
+        if len(token_set) == 0:
+            return None, 0.0, []
+
+        scored = []
+        for publication_id in self.get_candidates(token_set):
+            candidate_set = self.token_sets[publication_id]
+            score = len(token_set & candidate_set) / len(token_set | candidate_set)
+            scored.append((score, publication_id))
+        scored.sort(reverse=True)
+
+        if len(scored) == 0 or scored[0][0] < min_score:
+            return None, scored[0][0] if scored else 0.0, []
+        best_score = scored[0][0]
+        ambiguous = [(self.publications[publication_id], score) for score, publication_id in scored[1:] if best_score - score <= ambiguity_margin]
+        if len(ambiguous) > 0:
+            return None, best_score, [(self.publications[scored[0][1]], best_score)] + ambiguous
+        return self.publications[scored[0][1]], best_score, []
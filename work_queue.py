@@ -0,0 +1,76 @@
+import os
+from storage import load_dict, save_dict
+
+# fila de trabalho persistente do crawl: cada item de cada etapa tem um estado, gravado no
+# checkpoint; ao reiniciar, o crawl volta direto para o que ficou pendente
+WORK_QUEUE_JSON_PATH = os.path.join('data', 'work_queue.json')
+STAGES = ('citations', 'agency', 'metadata', 'orcid')
+STATES = ('pending', 'in_flight', 'done', 'failed')
+MAX_ATTEMPTS = 3
+
+
+class WorkQueue:
+    def __init__(self, file_json_path=WORK_QUEUE_JSON_PATH):
+        self.file_json_path = file_json_path
+        self.entries = load_dict(file_json_path)
+        # por etapa e estado, um dict usado como conjunto ordenado de itens
+        self.items = {stage: {state: dict() for state in STATES} for stage in STAGES}
+        for key, entry in self.entries.items():
+            stage, item = key.split(':', 1)
+            if entry['state'] == 'in_flight':
+                # a execução anterior parou no meio desse item, ele volta para a fila
+                entry = dict(entry, state='pending')
+                self.entries[key] = entry
+            self.items[stage][entry['state']][item] = None
+
+    def get_state(self, stage, item):
+        entry = self.entries.get(f'{stage}:{item}')
+        return entry['state'] if entry is not None else None
+
+    def get_error(self, stage, item):
+        entry = self.entries.get(f'{stage}:{item}')
+        return entry.get('error') if entry is not None else None
+
+    def set_state(self, stage, item, state, **fields):
+        key = f'{stage}:{item}'
+        previous = self.entries.get(key, { 'state': None, 'attempts': 0 })
+        if previous['state'] is not None:
+            del self.items[stage][previous['state']][item]
+        self.entries[key] = dict(previous, state=state, **fields)
+        self.items[stage][state][item] = None
+
+    def add(self, stage, items):
+        added = 0
+        for item in items:
+            if self.get_state(stage, item) is None:
+                self.set_state(stage, item, 'pending')
+                added += 1
+        return added
+
+    def get_pending(self, stage):
+        return list(self.items[stage]['pending'])
+
+    def start(self, stage, item):
+        self.set_state(stage, item, 'in_flight')
+
+    def finish(self, stage, item):
+        self.set_state(stage, item, 'done', error=None)
+
+    def keep_partial(self, stage, item):
+        # resultado incompleto, mas não é falha: volta para pendente sem gastar tentativa
+        self.set_state(stage, item, 'pending', error='partial')
+
+    def fail(self, stage, item, error):
+        # volta para pendente até MAX_ATTEMPTS execuções falharem
+        attempts = self.entries.get(f'{stage}:{item}', dict()).get('attempts', 0) + 1
+        self.set_state(stage, item, 'failed' if attempts >= MAX_ATTEMPTS else 'pending', attempts=attempts, error=error)
+
+    def retry_failed(self, stage):
+        for item in list(self.items[stage]['failed']):
+            self.set_state(stage, item, 'pending', attempts=0)
+
+    def get_counts(self):
+        return {stage: {state: len(items) for state, items in states.items()} for stage, states in self.items.items()}
+
+    def checkpoint(self):
+        save_dict(self.entries, self.file_json_path)